@@ -5,13 +5,26 @@
 Данные настройки будут храниться как переменные окружения в .env файле.
 """
 
+from socket import gethostname
+
 from mau.session import SessionManager
 from pydantic import PostgresDsn
 from pydantic_settings import BaseSettings
 from redis.asyncio.client import Redis
 
-from mau_server.services.events import WebSocketEventHandler
+from mau_server.services.actors import RoomActors
+from mau_server.services.bus import RedisEventBus
+from mau_server.services.events import OverflowPolicy, WebSocketEventHandler
+from mau_server.services.leaderboard import Leaderboard
+from mau_server.services.passwords import PasswordHasher
+from mau_server.services.results import ResultWriter
+from mau_server.services.room_directory import RoomDirectory
+from mau_server.services.room_index import RoomIndex
+from mau_server.services.sharding import ShardManager
+from mau_server.services.snapshots import SessionSnapshots
 from mau_server.services.token import SimpleTokenManager
+from mau_server.services.turns import TurnTimer
+from mau_server.services.views import GameViews
 
 
 class Config(BaseSettings):
@@ -22,6 +35,34 @@ class Config(BaseSettings):
         db_url: Путь к основной базе данных для TortoiseORM.
         test_db_url: Путь к тестовой базе данных для TortoiseORM.
         debug: Отладочный режим работы без сохранения данных.
+        ws_queue_size: Сколько событий может ждать отправки клиенту.
+        ws_send_timeout: Сколько секунд ждать отправки одного события.
+        ws_overflow_policy: Что делать с клиентом при переполнении
+            очереди событий.
+        event_bus: Обмениваться игровыми событиями между процессами
+            сервера через Redis.
+        sharding: Распределять игровые комнаты между процессами.
+            Требует включённой шины событий.
+        worker_id: Уникальный ID процесса сервера, одинаковый между
+            перезапусками.
+            По умолчанию имя хоста, при нескольких процессах на одном
+            хосте его нужно указать для каждого процесса.
+        worker_url: Адрес, по которому другие процессы перенаправляют
+            запросы к комнатам этого процесса.
+            Обязателен при распределении комнат.
+        snapshot_interval: Как часто сохранять игровые сессии в Redis.
+        results_batch: Сколько итогов игр записывать одной транзакцией.
+        token_cache_size: Сколько проверенных токенов хранить в памяти.
+        token_cache_ttl: Сколько секунд хранить проверенный токен.
+        bcrypt_rounds: Сложность хеширования паролей.
+        bcrypt_workers: Сколько паролей можно хешировать одновременно.
+        bcrypt_queue: Сколько операций с паролями может ждать очереди.
+        room_queue: Сколько игровых команд комнаты может ждать
+            выполнения.
+        turn_timeout: Сколько секунд длится ход, после чего он
+            пропускается автоматически. 0 отключает ограничение.
+        metrics_key: Ключ доступа к внутренней статистике сервера.
+            Если не указан, статистика недоступна.
 
     """
 
@@ -29,6 +70,23 @@ class Config(BaseSettings):
     db_url: PostgresDsn
     redis_url: str
     debug: bool
+    ws_queue_size: int = 64
+    ws_send_timeout: float = 5.0
+    ws_overflow_policy: OverflowPolicy = OverflowPolicy.drop_oldest
+    event_bus: bool = False
+    sharding: bool = False
+    worker_id: str = gethostname()
+    worker_url: str = ""
+    snapshot_interval: float = 10.0
+    results_batch: int = 50
+    token_cache_size: int = 4096
+    token_cache_ttl: float = 60.0
+    bcrypt_rounds: int = 12
+    bcrypt_workers: int = 2
+    bcrypt_queue: int = 64
+    room_queue: int = 64
+    turn_timeout: float = 60.0
+    metrics_key: str = ""
 
 
 # Создаём экземпляр настроек
@@ -37,7 +95,41 @@ redis = Redis.from_url(
     config.redis_url, encoding="utf-8", decode_responses=True
 )
 
-stm = SimpleTokenManager(config.jwt_key, ttl=86_400)
+stm = SimpleTokenManager(
+    config.jwt_key,
+    ttl=86_400,
+    cache_size=config.token_cache_size,
+    cache_ttl=config.token_cache_ttl,
+)
+bus = RedisEventBus(redis) if config.event_bus else None
 sm: SessionManager[WebSocketEventHandler] = SessionManager(
-    event_handler=WebSocketEventHandler()
+    event_handler=WebSocketEventHandler(
+        queue_size=config.ws_queue_size,
+        send_timeout=config.ws_send_timeout,
+        policy=config.ws_overflow_policy,
+        bus=bus,
+    )
+)
+shards = ShardManager(
+    redis,
+    config.worker_id,
+    config.worker_url,
+    enabled=config.sharding,
+    bus=bus,
+)
+snapshots = SessionSnapshots(
+    Redis.from_url(config.redis_url), sm, interval=config.snapshot_interval
+)
+room_index = RoomIndex(bus)
+views = GameViews(sm._event_handler)
+actors = RoomActors(queue_size=config.room_queue)
+turns = TurnTimer(sm, actors, timeout=config.turn_timeout)
+directory = RoomDirectory(sm._event_handler, bus)
+hasher = PasswordHasher(
+    rounds=config.bcrypt_rounds,
+    workers=config.bcrypt_workers,
+    max_pending=config.bcrypt_queue,
 )
+leaderboard = Leaderboard(redis)
+results = ResultWriter(redis, leaderboard, batch_size=config.results_batch)
+results.on_saved = stm.forget
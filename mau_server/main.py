@@ -12,8 +12,20 @@ from loguru import logger
 from tortoise import generate_config
 from tortoise.contrib.fastapi import RegisterTortoise
 
-from mau_server.config import config
+from mau_server.config import (
+    actors,
+    config,
+    directory,
+    hasher,
+    results,
+    shards,
+    sm,
+    snapshots,
+    turns,
+)
+from mau_server.migrations import migrate
 from mau_server.routers import ROUTERS
+from mau_server.services.game_context import hand_off, serves
 
 
 @asynccontextmanager
@@ -37,8 +49,24 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         add_exception_handlers=True,
     ):
         # db connected
+        await migrate()
+        await directory.load()
+        await sm._event_handler.start()
+        shards.on_lost = hand_off
+        await shards.start()
+        await snapshots.start()
+        await results.start()
+        turns.serves = serves
+        await turns.start()
         yield
         # app teardown
+        await turns.stop()
+        await actors.stop()
+        await results.stop()
+        await snapshots.stop()
+        await shards.stop()
+        await sm._event_handler.stop()
+        hasher.shutdown()
 
 
 app = FastAPI(
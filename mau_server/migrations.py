@@ -0,0 +1,81 @@
+"""Миграции базы данных.
+
+TortoiseORM при запуске создаёт только недостающие таблицы.
+Новые столбцы, индексы и перенос данных в уже существующей базе
+данных выполняются здесь.
+
+Каждая миграция выполняется один раз в отдельной транзакции, имена
+выполненных миграций хранятся в таблице `migrations`.
+Миграции должны работать и на только что созданной базе данных,
+поэтому все изменения схемы пишутся с `IF NOT EXISTS`.
+"""
+
+from loguru import logger
+from tortoise.transactions import in_transaction
+
+from mau_server.models import ROOM_LIST_INDEX
+
+MIGRATIONS: list[tuple[str, list[str]]] = [
+    (
+        # Раньше победители и проигравшие хранились в одной общей
+        # таблице `game_user`, и различить их уже нельзя.
+        # Поэтому старые записи переносятся в обе таблицы, ровно как
+        # их раньше и возвращали оба поля.
+        # Старая таблица остаётся нетронутой.
+        "0001_split_game_results",
+        [
+            """
+            DO $$
+            BEGIN
+                IF to_regclass('game_user') IS NOT NULL THEN
+                    INSERT INTO game_winners (game_id, user_id)
+                    SELECT game_id, user_id FROM game_user
+                    ON CONFLICT DO NOTHING;
+                    INSERT INTO game_losers (game_id, user_id)
+                    SELECT game_id, user_id FROM game_user
+                    ON CONFLICT DO NOTHING;
+                END IF;
+            END $$;
+            """,
+        ],
+    ),
+    (
+        # Индекс для списка открытых комнат из `Room.Meta.indexes`
+        "0002_room_list_index",
+        [
+            f"CREATE INDEX IF NOT EXISTS {ROOM_LIST_INDEX} "
+            "ON room (private, status, create_time)",
+        ],
+    ),
+    (
+        # Версия комнаты для ETag из `Room.version`
+        "0003_room_version",
+        [
+            "ALTER TABLE room "
+            "ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 0",
+        ],
+    ),
+]
+
+
+async def migrate() -> None:
+    """Выполняет ещё не выполненные миграции по порядку."""
+    async with in_transaction("models") as conn:
+        await conn.execute_script(
+            "CREATE TABLE IF NOT EXISTS migrations ("
+            "name VARCHAR(64) PRIMARY KEY, "
+            "applied TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        _, rows = await conn.execute_query("SELECT name FROM migrations")
+    applied = {row["name"] for row in rows}
+
+    for name, statements in MIGRATIONS:
+        if name in applied:
+            continue
+        async with in_transaction("models") as conn:
+            for statement in statements:
+                await conn.execute_script(statement)
+            await conn.execute_query(
+                "INSERT INTO migrations (name) VALUES ($1)", [name]
+            )
+        logger.info("Apply database migration {}", name)
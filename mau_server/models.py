@@ -11,6 +11,10 @@ TortoiseORM предоставляет удобный API для управле
 from enum import StrEnum
 
 from tortoise import Model, fields
+from tortoise.indexes import Index
+
+# Имя индекса списка открытых комнат, создаётся также миграцией
+ROOM_LIST_INDEX = "room_public_list_idx"
 
 
 class RoomState(StrEnum):
@@ -40,6 +44,7 @@ class User(Model):
     # Статистика пользователя для таблицы лидеров
     play_count = fields.IntField(default=0)
     win_count = fields.IntField(default=0)
+    # Сколько карт осталось на руках в конце всех игр, меньше - лучше
     cards_count = fields.IntField(default=0)
 
     # Комнатки
@@ -79,9 +84,22 @@ class Room(Model):
     status = fields.CharEnumField(RoomState, default=RoomState.idle)
     status_updates = fields.DatetimeField(auto_now_add=True)
 
+    # Увеличивается при каждом изменении комнаты, для ETag
+    version = fields.IntField(default=0)
+
     # История игр комнаты
     games = fields.ReverseRelation["Game"]
 
+    class Meta:
+        """Индексы для списка открытых комнат."""
+
+        indexes = (
+            Index(
+                fields=("private", "status", "create_time"),
+                name=ROOM_LIST_INDEX,
+            ),
+        )
+
 
 class Game(Model):
     """Сохранённая игровая сессия.
@@ -100,8 +118,8 @@ class Game(Model):
         "models.Room", related_name="games"
     )
     winners: fields.ManyToManyRelation[User] = fields.ManyToManyField(
-        "models.User", related_name="win_games"
+        "models.User", related_name="win_games", through="game_winners"
     )
     losers: fields.ManyToManyRelation[User] = fields.ManyToManyField(
-        "models.User", related_name="lose_games"
+        "models.User", related_name="lose_games", through="game_losers"
     )
@@ -1,7 +1,13 @@
 """Хранит в себе все публичные маршруты сервера."""
 
-from mau_server.routers import game, leaaderboard, roomlist, users
+from mau_server.routers import game, leaaderboard, metrics, roomlist, users
 
-ROUTERS = (roomlist.router, leaaderboard.router, game.router, users.router)
+ROUTERS = (
+    roomlist.router,
+    leaaderboard.router,
+    game.router,
+    users.router,
+    metrics.router,
+)
 
 __all__ = ("ROUTERS",)
@@ -1,63 +1,125 @@
 """Обработка игры."""
 
+from collections.abc import Awaitable, Callable
+from functools import wraps
+from typing import Any, ParamSpec
+from uuid import UUID
+
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
+    Request,
+    Response,
 )
 from loguru import logger
 from mau.deck.behavior import TakeBehavior, WildTakeBehavior
 from mau.deck.card import MauCard
 from mau.enums import CardColor, GameState
 from mau.game.player import BaseUser
-
-from mau_server.config import sm
-from mau_server.models import Game, User
-from mau_server.schemes.game import ContextData, GameContext, dump_context
-from mau_server.services.game_context import game_context
+from pydantic import ValidationError
+
+from mau_server.config import (
+    actors,
+    results,
+    room_index,
+    shards,
+    sm,
+    stm,
+    turns,
+    views,
+)
+from mau_server.models import User
+from mau_server.schemes.game import (
+    CommandAck,
+    CommandAction,
+    ContextData,
+    GameCommand,
+    GameContext,
+    dump_result,
+    encode,
+)
+from mau_server.services.etag import etag_matches, not_modified
+from mau_server.services.game_context import (
+    close_session,
+    game_context,
+    load_game,
+    room_context,
+)
+from mau_server.services.turns import skip_turn
 
 router = APIRouter(prefix="/game", tags=["games"])
 
+_P = ParamSpec("_P")
+
 
 async def save_game(ctx: GameContext) -> None:
-    """Записывает игру в базу данных."""
+    """Завершает игру и ставит её итоги в очередь на запись.
+
+    Сами итоги записываются в базу данных в фоне, поэтому последний
+    ход игры не ждёт базу данных.
+    """
     if ctx.game is None:
         return
 
-    game = Game(
-        create_time=ctx.game.game_start,
-        owner=await User.get_or_none(username=ctx.game.owner.user_id),
-        room=ctx.room,
-    )
-
-    for pl in ctx.game.pm.iter(ctx.game.pm.winners):
-        winner = await User.get_or_none(username=pl.user_id)
-        if winner is not None:
-            await game.winners.add(winner)
-        else:
-            logger.error("Not found winner {}", pl.user_id)
-
-    for pl in ctx.game.pm.iter(ctx.game.pm.losers):
-        loser = await User.get_or_none(username=pl.user_id)
-        if loser is not None:
-            await game.losers.add(loser)
-        else:
-            logger.error("Not found loser {}", pl.user_id)
-
-    await game.save()
-    sm.remove(str(ctx.room.id))
+    await results.submit(dump_result(ctx.game, ctx.room.id))
+    await close_session(str(ctx.room.id))
     ctx.game = None
     ctx.player = None
 
 
+def context_response(ctx: GameContext, changed: bool = True) -> Response:
+    """Отправляет игровой контекст.
+
+    Контекст кодируется сразу в JSON, минуя создание и проверку схемы
+    ответа `ContextData`, и переиспользуется, пока игра не изменится.
+    Все маршруты, кроме чтения, считаются изменившими игру.
+    """
+    return Response(
+        views.context(ctx, changed=changed), media_type="application/json"
+    )
+
+
+def room_command(
+    func: Callable[_P, Awaitable[Response]],
+) -> Callable[_P, Awaitable[Response]]:
+    """Выполняет маршрут в очереди команд комнаты.
+
+    Маршруты одной комнаты выполняются строго по очереди.
+    Игра и игрок берутся заново уже в очереди, так как предыдущая
+    команда могла завершить игру.
+    """
+
+    @wraps(func)
+    async def wrapper(*args: _P.args, **kwargs: _P.kwargs) -> Response:
+        ctx = kwargs.get("ctx")
+        if not isinstance(ctx, GameContext):
+            ctx = next(arg for arg in args if isinstance(arg, GameContext))
+
+        async def command() -> Response:
+            room_id = str(ctx.room.id)
+            ctx.game = sm.room(room_id)
+            ctx.player = None
+            ctx.version = sm._event_handler.version(room_id)
+            if ctx.game is not None:
+                ctx.player = sm.player(ctx.user.username)
+            return await func(*args, **kwargs)
+
+        return await actors.run(str(ctx.room.id), command)
+
+    return wrapper
+
+
 # Player routers
 # ==============
 
 
-@router.post("/join/")
+@router.post("/join/", response_model=ContextData)
+@room_command
 async def join_player_to_game(
     ctx: GameContext = Depends(game_context),
-) -> ContextData:
+) -> Response:
     """Добавляет активного пользователя в комнату.
 
     Под пользователем имеется ввиду активная учётная запись.
@@ -71,13 +133,14 @@ async def join_player_to_game(
     ctx.game.join_player(
         BaseUser(ctx.user.id, ctx.user.name, ctx.user.username)
     )
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/leave")
+@router.post("/leave", response_model=ContextData)
+@room_command
 async def leave_player_from_room(
     ctx: GameContext = Depends(game_context),
-) -> ContextData:
+) -> Response:
     """Выходит из активной комнаты.
 
     Предполагается что прямо сейчас пользователь есть в игре.
@@ -89,30 +152,73 @@ async def leave_player_from_room(
     if not ctx.game.started:
         await save_game(ctx)
 
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
 # Session Routers
 # ===============
 
 
-@router.get("/")
+@router.get("/", response_model=ContextData)
 async def get_active_game(
-    ctx: GameContext = Depends(game_context),
-) -> ContextData:
+    request: Request, user: User = Depends(stm.read_token)
+) -> Response:
     """Получает игровой контекст.
 
     Включает в себя данные о пользователе, комнате, текущей игре
     и игроке.
     может быть полезно чтобы обновить полную информацию о контексте.
+
+    Ответ помечается ETag по версии игры.
+    Если игра не изменилась, вернётся 304 без сборки контекста.
     """
-    return await dump_context(ctx)
+    room = await room_index.room(user)
+    if room is not None and sm.room(str(room.id)) is not None:
+        etag = views.etag(str(room.id), user.id)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    ctx = await game_context(request, user)
+    response = context_response(ctx, changed=False)
+    if ctx.game is not None:
+        response.headers["ETag"] = views.etag(str(ctx.room.id), user.id)
+    return response
+
+
+@router.get("/poll", response_model=ContextData)
+async def poll_active_game(
+    request: Request,
+    version: int,
+    wait_time: float = Query(default=25.0, ge=0, le=60),
+    user: User = Depends(stm.read_token),
+) -> Response:
+    """Ждёт изменения игры и получает новый игровой контекст.
+
+    Для клиентов, которые не могут держать веб сокет.
+    Запрос ждёт, пока версия игры не отличится от `version`, но не
+    дольше `wait_time` секунд.
+    Если игра так и не изменилась, вернётся 304.
+    Если в комнате ещё нет игры, запрос ждёт её начала, а не
+    возвращается сразу, чтобы клиент не опрашивал сервер без пауз.
+    """
+    room = await room_index.room(user)
+    if room is not None:
+        room_id = str(room.id)
+        if await shards.owner(room_id) == shards.worker_id:
+            handler = sm._event_handler
+            if await load_game(room_id) is None:
+                version = handler.version(room_id)
+            if not await handler.wait(room_id, version, wait_time):
+                return not_modified(views.etag(room_id, user.id))
+
+    return await get_active_game(request, user)
 
 
-@router.post("/start")
+@router.post("/start", response_model=ContextData)
+@room_command
 async def start_room_game(
     ctx: GameContext = Depends(game_context),
-) -> ContextData:
+) -> Response:
     """Начинает новую игру в комнате.
 
     Включает в себя как процесс создания комнаты, так и начало игры.
@@ -135,13 +241,14 @@ async def start_room_game(
         ctx.game.join_player(BaseUser(user.username, user.name))
 
     ctx.game.start()
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/end")
+@router.post("/end", response_model=ContextData)
+@room_command
 async def end_room_game(
     ctx: GameContext = Depends(game_context),
-) -> ContextData:
+) -> Response:
     """Принудительно завершает игру в комнате.
 
     Редко используемая опция, тем не менее имеет место быть.
@@ -152,13 +259,14 @@ async def end_room_game(
         raise HTTPException(401, "You are not a room owner to end this game")
 
     await save_game(ctx)
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/kick/{user_id}")
+@router.post("/kick/{user_id}", response_model=ContextData)
+@room_command
 async def kick_player(
     user_id: str, ctx: GameContext = Depends(game_context)
-) -> ContextData:
+) -> Response:
     """Исключает пользователя из игры.
 
     После пользователь сможет вернутся только как наблюдатель.
@@ -175,30 +283,37 @@ async def kick_player(
     ctx.game.leave_player(kick_player)
     if not ctx.game.started:
         await save_game(ctx)
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/skip")
-async def skip_player(ctx: GameContext = Depends(game_context)) -> ContextData:
+@router.post("/skip", response_model=ContextData)
+@room_command
+async def skip_player(ctx: GameContext = Depends(game_context)) -> Response:
     """Пропускает игрока.
 
     Если к примеру игрок зазевался и не даёт продолжать игру.
+    Владелец комнаты может пропустить ход в любой момент, остальные
+    игроки только когда время хода вышло.
+    Обычно такие ходы сервер пропускает сам.
     """
     if ctx.game is None:
         raise HTTPException(404, "No active game to skip player")
+    elif ctx.user != ctx.room.owner and (
+        ctx.player is None or not turns.expired(ctx.game)
+    ):
+        raise HTTPException(403, "Turn time is not over yet")
 
-    ctx.game.take_counter += 1
-    ctx.game.player.take_cards()
-    ctx.game.next_turn()
-    return await dump_context(ctx)
+    skip_turn(ctx.game)
+    return context_response(ctx)
 
 
 # Turn routers
 # ============
 
 
-@router.post("/next")
-async def next_turn(ctx: GameContext = Depends(game_context)) -> ContextData:
+@router.post("/next", response_model=ContextData)
+@room_command
+async def next_turn(ctx: GameContext = Depends(game_context)) -> Response:
     """Передает ход дальше.
 
     Есть такая вероятность что пользователи могут шалить, пропуская свой ход.
@@ -212,11 +327,12 @@ async def next_turn(ctx: GameContext = Depends(game_context)) -> ContextData:
         raise HTTPException(404, "It's not your turn to skip it.")
 
     ctx.game.next_turn()
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/take")
-async def take_cards(ctx: GameContext = Depends(game_context)) -> ContextData:
+@router.post("/take", response_model=ContextData)
+@room_command
+async def take_cards(ctx: GameContext = Depends(game_context)) -> Response:
     """Взятие карт.
 
     Игрок берёт количество карт, равное игровому счётчику.
@@ -231,13 +347,14 @@ async def take_cards(ctx: GameContext = Depends(game_context)) -> ContextData:
         raise HTTPException(404, "You are not a game player")
 
     ctx.player.call_take_cards()
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/shotgun/take")
+@router.post("/shotgun/take", response_model=ContextData)
+@room_command
 async def shotgun_take_cards(
     ctx: GameContext = Depends(game_context),
-) -> ContextData:
+) -> Response:
     """Взять карты, чтобы не стрелять.
 
     В случае, когда игрок решил что лучше взять карты, чем рисковать
@@ -254,11 +371,12 @@ async def shotgun_take_cards(
         and ctx.game.take_counter
     ):
         ctx.game.next_turn()
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/shotgun/shot")
-async def shotgun_shot(ctx: GameContext = Depends(game_context)) -> ContextData:
+@router.post("/shotgun/shot", response_model=ContextData)
+@room_command
+async def shotgun_shot(ctx: GameContext = Depends(game_context)) -> Response:
     """Когда решил стрелять, лишь бы не брать карты."""
     if ctx.game is None:
         raise HTTPException(404, "No active game in room")
@@ -278,11 +396,12 @@ async def shotgun_shot(ctx: GameContext = Depends(game_context)) -> ContextData:
 
     if not ctx.game.started:
         await save_game(ctx)
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/bluff")
-async def bluff_player(ctx: GameContext = Depends(game_context)) -> ContextData:
+@router.post("/bluff", response_model=ContextData)
+@room_command
+async def bluff_player(ctx: GameContext = Depends(game_context)) -> Response:
     """Проверка игрока на честность."""
     if ctx.game is None:
         raise HTTPException(404, "No active game in room")
@@ -290,13 +409,14 @@ async def bluff_player(ctx: GameContext = Depends(game_context)) -> ContextData:
         raise HTTPException(404, "You are not a game player")
 
     ctx.player.call_bluff()
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/color/{color}")
+@router.post("/color/{color}", response_model=ContextData)
+@room_command
 async def select_card_color(
     color: CardColor, ctx: GameContext = Depends(game_context)
-) -> ContextData:
+) -> Response:
     """Выбирает цвет для карты выбор цвета или +4."""
     if ctx.game is None:
         raise HTTPException(404, "No active game in room")
@@ -304,13 +424,14 @@ async def select_card_color(
         raise HTTPException(404, "You are not a game player")
 
     ctx.game.choose_color(color)
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/player/{user_id}")
+@router.post("/player/{user_id}", response_model=ContextData)
+@room_command
 async def select_player(
     user_id: str, ctx: GameContext = Depends(game_context)
-) -> ContextData:
+) -> Response:
     """Выбирает игрока, с кем можно обменяться картами."""
     if ctx.game is None:
         raise HTTPException(404, "No active game in room")
@@ -324,14 +445,15 @@ async def select_player(
     if ctx.game.state == GameState.TWIST_HAND:
         ctx.player.twist_hand(other_player)
 
-    return await dump_context(ctx)
+    return context_response(ctx)
 
 
-@router.post("/card/")
+@router.post("/card/", response_model=ContextData)
+@room_command
 async def push_card_from_hand(
     card: MauCard | None = Depends(MauCard.unpack),
     ctx: GameContext = Depends(game_context),
-) -> ContextData:
+) -> Response:
     """Разыгрывает карту из руки игрока."""
     if card is None:
         raise HTTPException(404, "Card is None")
@@ -345,4 +467,79 @@ async def push_card_from_hand(
     if not ctx.game.started:
         await save_game(ctx)
 
-    return await dump_context(ctx)
+    return context_response(ctx)
+
+
+# Команды через веб сокет
+# =======================
+
+# Параметры команд проверяются до выполнения самой команды
+_ARGS: dict[CommandAction, Callable[[dict[str, str]], dict[str, Any]]] = {
+    CommandAction.card: lambda args: {"card": MauCard.unpack(args["card"])},
+    CommandAction.color: lambda args: {"color": CardColor(int(args["color"]))},
+    CommandAction.player: lambda args: {"user_id": args["user_id"]},
+}
+
+_COMMANDS: dict[
+    CommandAction,
+    Callable[[GameContext, dict[str, Any]], Awaitable[Response]],
+] = {
+    CommandAction.card: lambda ctx, args: push_card_from_hand(
+        card=args["card"], ctx=ctx
+    ),
+    CommandAction.take: lambda ctx, args: take_cards(ctx),
+    CommandAction.bluff: lambda ctx, args: bluff_player(ctx),
+    CommandAction.color: lambda ctx, args: select_card_color(
+        args["color"], ctx
+    ),
+    CommandAction.player: lambda ctx, args: select_player(args["user_id"], ctx),
+    CommandAction.shotgun_take: lambda ctx, args: shotgun_take_cards(ctx),
+    CommandAction.shotgun_shot: lambda ctx, args: shotgun_shot(ctx),
+    CommandAction.next: lambda ctx, args: next_turn(ctx),
+    CommandAction.skip: lambda ctx, args: skip_player(ctx),
+}
+
+
+def _command_error(
+    command_id: int | str | None, status: int, detail: str
+) -> str:
+    return CommandAck(
+        id=command_id, ok=False, status=status, detail=detail
+    ).model_dump_json()
+
+
+async def run_command(user: User, room_id: UUID, frame: str) -> str:
+    """Выполняет игровую команду из веб сокета комнаты.
+
+    Команда выполняется тем же маршрутом, что и через HTTP, но
+    пользователь уже известен по подключению, а комната берётся из
+    индекса активных комнат.
+    Вернёт кадр ответа на команду `CommandAck`.
+    """
+    try:
+        command = GameCommand.model_validate_json(frame)
+    except ValidationError:
+        return _command_error(None, 400, "Invalid command")
+    command_id = command.id
+    parse = _ARGS.get(command.action)
+    try:
+        args = {} if parse is None else parse(command.args)
+    except (KeyError, ValueError):
+        return _command_error(command_id, 400, "Invalid command")
+
+    try:
+        room = await room_index.room(user)
+        if room is None or room.id != room_id:
+            raise HTTPException(403, "User is not in this room")
+        ctx = await room_context(user, room)
+        response = await _COMMANDS[command.action](ctx, args)
+    except HTTPException as e:
+        return _command_error(command_id, e.status_code, str(e.detail))
+    except Exception as e:
+        logger.exception(e)
+        return _command_error(command_id, 500, "Command failed")
+
+    return (
+        b'{"id":%b,"ok":true,"context":%b}'
+        % (encode(command_id), response.body)
+    ).decode()
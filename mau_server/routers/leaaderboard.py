@@ -1,39 +1,43 @@
 """Таблица лидеров."""
 
-from enum import StrEnum
-
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 
+from mau_server.config import leaderboard
 from mau_server.models import User
 from mau_server.schemes.db import UserData
+from mau_server.schemes.leaderboard import CategoryEnum, LeaderboardEntry
 
 router = APIRouter(prefix="/leaderboard", tags=["rating"])
 
 
-class CategoryEnum(StrEnum):
-    """Все используемые категории в таблице лидеров."""
-
-    gems = "gems"
-    play_count = "games"
-    win_count = "wins"
-    cards_count = "cards"
-
-
 @router.get("/{username}/{category}")
 async def get_my_leaderboard_index(
     username: str, category: CategoryEnum
 ) -> int:
-    """Получает таблицу лидеров из базы данных."""
-    user = await User.get_or_none(username=username)
-    if user is None:
+    """Получает место пользователя в таблице лидеров."""
+    position = await leaderboard.rank(category, username)
+    if position is None:
         raise HTTPException(404, "User not found")
-    position = (await User.filter(gems__gt=user.gems).count()) + 1
     return position
 
 
+@router.get("/{username}/{category}/around")
+async def get_leaderboard_around_user(
+    username: str,
+    category: CategoryEnum,
+    radius: int = Query(default=5, ge=0, le=50),
+) -> list[LeaderboardEntry]:
+    """Получает соседей пользователя по таблице лидеров."""
+    entries = await leaderboard.around(category, username, radius)
+    if entries is None:
+        raise HTTPException(404, "User not found")
+    return entries
+
+
 @router.get("/{category}")
 async def get_leaderboard_by_category(category: CategoryEnum) -> list[UserData]:
-    """Получает таблицу лидеров из базы данных."""
-    return await UserData.from_queryset(
-        User.all().order_by("-" + category.name).limit(100)
-    )
+    """Получает лучших пользователей категории."""
+    usernames = await leaderboard.top(category, 100)
+    positions = {username: i for i, username in enumerate(usernames)}
+    users = await UserData.from_queryset(User.filter(username__in=usernames))
+    return sorted(users, key=lambda user: positions[user.username])
@@ -0,0 +1,52 @@
+"""Внутренняя статистика сервера.
+
+Позволяет следить за работой кешей и фоновых задач сервера.
+Статистика доступна только по ключу `METRICS_KEY` из настроек.
+"""
+
+from secrets import compare_digest
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from mau_server.config import (
+    actors,
+    config,
+    hasher,
+    results,
+    snapshots,
+    stm,
+    turns,
+    views,
+)
+from mau_server.services.token import bearer
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+def check_metrics_key(
+    cred: HTTPAuthorizationCredentials = Depends(bearer),
+) -> None:
+    """Проверяет ключ доступа к статистике.
+
+    Если ключ не задан в настройках, статистика недоступна.
+    """
+    if not config.metrics_key:
+        raise HTTPException(404, "Metrics are disabled")
+    if not compare_digest(cred.credentials, config.metrics_key):
+        raise HTTPException(401, "Invalid metrics key")
+
+
+@router.get("/", dependencies=[Depends(check_metrics_key)])
+async def get_metrics() -> dict[str, dict[str, float]]:
+    """Получает статистику всех служб сервера."""
+    return {
+        "token_cache": stm.stats(),
+        "snapshots": snapshots.stats(),
+        "passwords": hasher.stats(),
+        "results": results.stats(),
+        "views": views.stats(),
+        "actors": actors.stats(),
+        "room_queues": actors.depths(),
+        "turns": turns.stats(),
+    }
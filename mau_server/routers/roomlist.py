@@ -6,52 +6,217 @@
 - TODO: Готовность игроков.
 """
 
-import random
+import time
+from datetime import datetime
+from typing import Annotated
 from uuid import UUID
 
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
+    Request,
+    Response,
     WebSocket,
     WebSocketDisconnect,
 )
-from loguru import logger
+from fastapi.security import HTTPAuthorizationCredentials
 from mau.game.player import BaseUser
-
-from mau_server.config import sm, stm
+from tortoise.expressions import F
+from tortoise.functions import Count
+
+from mau_server.config import (
+    actors,
+    directory,
+    room_index,
+    shards,
+    sm,
+    snapshots,
+    stm,
+)
 from mau_server.models import Room, RoomState, User
-from mau_server.schemes.db import RoomData
-from mau_server.schemes.roomlist import RoomDataIn, RoomDelete
+from mau_server.routers.game import run_command
+from mau_server.schemes.db import RoomData, RoomListData
+from mau_server.schemes.game import CommandAck
+from mau_server.schemes.roomlist import (
+    RoomDataIn,
+    RoomDelete,
+    RoomFilter,
+    RoomOrder,
+    RoomPage,
+)
+from mau_server.services.etag import etag_matches, make_etag, not_modified
+from mau_server.services.game_context import close_session, load_game
+from mau_server.services.pagination import after, decode_cursor, encode_cursor
 
 router = APIRouter(prefix="/rooms", tags=["room list"])
 
 
+async def sync_room(room_id: UUID) -> None:
+    """Обновляет индекс и каталог комнат после изменения комнаты.
+
+    Также увеличивает версию комнаты, чтобы сбросить ETag.
+    """
+    await Room.filter(id=room_id).update(version=F("version") + 1)
+    room = await room_index.refresh(room_id)
+    if room is None:
+        directory.remove(room_id)
+    else:
+        directory.put(room)
+
+
 # получение информации о комнатах
 # ===============================
 
 
+@router.websocket("/lobby")
+async def watch_lobby(websocket: WebSocket) -> None:
+    """Подписывает клиента на изменения каталога открытых комнат.
+
+    Сначала клиент получает все открытые комнаты, затем только
+    добавленные, изменённые и удалённые комнаты.
+    """
+    await directory.connect(websocket)
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        directory.disconnect(websocket)
+
+
 @router.websocket("/{room_id}")
-async def add_client(room_id: UUID, websocket: WebSocket) -> None:
-    """Добавляет нового клиента для прослушивания игровых событий."""
-    await sm._event_handler.connect(str(room_id), websocket)
+async def add_client(
+    room_id: UUID, websocket: WebSocket, token: str | None = None
+) -> None:
+    """Добавляет нового клиента для прослушивания игровых событий.
+
+    Если при подключении передан токен, клиент может отправлять
+    игровые команды `GameCommand` и получает ответ `CommandAck` на
+    каждую.
+    Такой клиент сразу получает свою руку `HandData`, а затем после
+    каждого события, если она изменилась.
+    Пользователь проверяется один раз при подключении, поэтому ход
+    стоит одного кадра вместо целого HTTP запроса.
+    Когда срок действия токена истекает, сокет закрывается на
+    следующей команде.
+
+    С токеном можно подключиться только к своей комнате, наблюдать за
+    чужими комнатами можно только без токена.
+    """
+    user = None
+    expires = 0
+    if token is not None:
+        try:
+            user = await stm.read_token(
+                HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+            )
+            expires = stm.expires(token)
+            room = await room_index.room(user)
+            if room is None or room.id != room_id:
+                raise HTTPException(403, "User is not in this room")
+            if await shards.owner(str(room_id)) != shards.worker_id:
+                raise HTTPException(503, "Room is served by another worker")
+        except HTTPException as e:
+            await websocket.close(code=1008, reason=str(e.detail))
+            return
+
+    handler = sm._event_handler
+    game = None
+    if user is not None:
+        game = await load_game(str(room_id))
+    connection = await handler.connect(
+        str(room_id), websocket, None if user is None else user.username
+    )
+    if game is not None:
+        handler.send_hand(connection, game)
     try:
         while True:
             data = await websocket.receive_text()
-            logger.info(data)
+            if user is None:
+                handler.reply(
+                    connection,
+                    CommandAck(
+                        id=None,
+                        ok=False,
+                        status=401,
+                        detail="Connect with token to send commands",
+                    ).model_dump_json(),
+                )
+                continue
+            if time.time() >= expires:
+                handler.disconnect(str(room_id), websocket)
+                await websocket.close(code=1008, reason="Token has expired")
+                return
+            handler.reply(connection, await run_command(user, room_id, data))
     except WebSocketDisconnect:
-        sm._event_handler.disconnect(str(room_id), websocket)
+        handler.disconnect(str(room_id), websocket)
 
 
 @router.get("/")
 async def get_public_rooms(
-    order_by: str = "create_time", invert: bool = False
-) -> list[RoomData]:
-    """Получает все доступные открытые комнаты."""
-    return await RoomData.from_queryset(
-        Room.filter(private=False)
-        .exclude(status="ended")
-        .order_by("-" + order_by if not invert else order_by)
+    filters: Annotated[RoomFilter, Query()],
+    order_by: RoomOrder = RoomOrder.create_time,
+    invert: bool = False,
+    cursor: str | None = None,
+    limit: int = Query(default=50, ge=1, le=100),
+) -> RoomPage:
+    """Получает страницу доступных открытых комнат.
+
+    Комнаты упорядочены по выбранному полю и по ID при равенстве.
+    По умолчанию сначала идут большие значения, `invert` меняет
+    порядок.
+    Чтобы получить следующую страницу, передайте курсор из ответа.
+
+    Курсор действует только с тем же порядком, с которым он получен.
+    Игроки комнат в список не попадают, их можно получить по ID
+    комнаты.
+
+    Комнаты можно отфильтровать по вместимости (`min_capacity`,
+    `max_capacity`), по стоимости входа (`max_gems`) и по наличию
+    свободных мест (`free_seats`).
+    """
+    query = Room.filter(
+        private=False, status__in=(RoomState.idle, RoomState.game)
+    )
+    if filters.min_capacity is not None:
+        query = query.filter(max_players__gte=filters.min_capacity)
+    if filters.max_capacity is not None:
+        query = query.filter(max_players__lte=filters.max_capacity)
+    if filters.max_gems is not None:
+        query = query.filter(gems__lte=filters.max_gems)
+    if filters.free_seats:
+        query = query.annotate(players_count=Count("players")).filter(
+            players_count__lt=F("max_players")
+        )
+
+    field = order_by.value
+    if cursor is not None:
+        cursor_order, cursor_invert, value, last_id = decode_cursor(cursor, 4)
+        if cursor_order != field or cursor_invert != invert:
+            raise HTTPException(400, "Cursor does not match sort order")
+        try:
+            if order_by == RoomOrder.create_time:
+                value = datetime.fromisoformat(value)
+            elif not isinstance(value, int) or isinstance(value, bool):
+                raise TypeError(f"Expected int, got {value!r}")
+            last_id = UUID(last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(400, "Invalid cursor")
+        query = query.filter(after(field, value, last_id, not invert))
+
+    prefix = "" if invert else "-"
+    rooms = await RoomListData.from_queryset(
+        query.order_by(prefix + field, prefix + "id").limit(limit + 1)
+    )
+    if len(rooms) <= limit:
+        return RoomPage(rooms=rooms, cursor=None)
+
+    rooms = rooms[:limit]
+    last = rooms[-1]
+    return RoomPage(
+        rooms=rooms,
+        cursor=encode_cursor(field, invert, getattr(last, field), last.id),
     )
 
 
@@ -71,28 +236,42 @@ async def get_active_user_room(
 
 
 @router.get("/random")
-async def get_random_room() -> RoomData:
-    """Получает случайную доступную комнату."""
-    rooms = await Room.filter(private=False).exclude(status="ended")
-    if len(rooms) == 0:
+async def get_random_room(user: User = Depends(stm.read_token)) -> RoomData:
+    """Получает случайную открытую комнату, в которую можно войти.
+
+    В комнате должны быть свободные места, а вход должен быть по
+    карману пользователю.
+    """
+    room_id = directory.random(user.gems)
+    if room_id is None:
         raise HTTPException(404, "No open rooms to join")
-    random_room = rooms[random.randint(0, len(rooms) - 1)]
-    return await RoomData.from_tortoise_orm(random_room)
+    return await RoomData.from_queryset_single(Room.get(id=room_id))
 
 
-@router.get("/{room_id}")
-async def get_room_info(room_id: UUID) -> RoomData:
-    """Получает информацию о комнате по её ID."""
-    try:
-        room = await Room.get_or_none(id=room_id)
-    # На тот случай, если пользователь передаст плохой UUID
-    except Exception as e:
-        logger.error(e)
-        raise HTTPException(404, e)
+@router.get("/{room_id}", response_model=RoomData)
+async def get_room_info(room_id: UUID, request: Request) -> Response:
+    """Получает информацию о комнате по её ID.
 
-    if room is None:
+    Ответ помечается ETag по версии комнаты.
+    Если комната не изменилась, вернётся 304 без загрузки владельца и
+    игроков комнаты.
+    """
+    version = (
+        await Room.filter(id=room_id).first().values_list("version", flat=True)
+    )
+    if version is None:
         raise HTTPException(404, "Room not found")
-    return await RoomData.from_tortoise_orm(room)
+
+    etag = make_etag(room_id, version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    room = await RoomData.from_queryset_single(Room.get(id=room_id))
+    return Response(
+        room.model_dump_json(),
+        media_type="application/json",
+        headers={"ETag": make_etag(room_id, room.version)},
+    )
 
 
 # Управление комнатой
@@ -108,7 +287,9 @@ async def create_new_room(user: User = Depends(stm.read_token)) -> RoomData:
     if current_room is not None:
         raise HTTPException(409, "User already in room")
 
+    # ID подбирается так, чтобы игра комнаты жила в этом процессе
     room = await Room.create(
+        id=shards.new_room_id(),
         name=f"комната {user.name}",
         owner_id=user.id,
     )
@@ -118,10 +299,22 @@ async def create_new_room(user: User = Depends(stm.read_token)) -> RoomData:
         str(room.id),
         BaseUser(str(user.id), user.name, user.username),
     )
+    await shards.claim(str(room.id))
+    snapshots.track(str(room.id))
+    await sync_room(room.id)
 
     return await RoomData.from_tortoise_orm(room)
 
 
+async def end_session(room_id: UUID) -> None:
+    """Завершает игру удалённой или завершённой комнаты.
+
+    Выполняется в очереди команд комнаты, чтобы не прервать
+    выполняемую игровую команду.
+    """
+    await actors.run(str(room_id), lambda: close_session(str(room_id)))
+
+
 @router.put("/{room_id}")
 async def update_room(
     room_id: UUID,
@@ -135,8 +328,12 @@ async def update_room(
     if room.owner != user:
         raise HTTPException(401, "User is not room owner")
 
-    await room.update_from_dict(room_data.model_dump(exclude_unset=True))
-    await room.save()
+    # Версию увеличивает только `sync_room`, её нельзя перезаписывать
+    update = room_data.model_dump(exclude_unset=True)
+    if update:
+        await room.update_from_dict(update)
+        await room.save(update_fields=list(update))
+    await sync_room(room.id)
     return await RoomData.from_tortoise_orm(room)
 
 
@@ -153,6 +350,9 @@ async def delete_room(
         raise HTTPException(401, "User is not room owner")
 
     await room.delete()
+    await end_session(room_id)
+    room_index.remove(room_id)
+    directory.remove(room_id)
     return RoomDelete(room_id=room_id)
 
 
@@ -224,10 +424,13 @@ async def join_in_room(
     if room_user is not None:
         raise HTTPException(409, "User already join this room")
 
+    # Пользователь мог прийти из кеша токенов
+    await user.refresh_from_db(fields=["gems"])
     if room.gems > user.gems:
         raise HTTPException(403, "Not enough gems to join room")
 
     await room.players.add(user)
+    await sync_room(room.id)
     return await RoomData.from_tortoise_orm(room)
 
 
@@ -247,6 +450,7 @@ async def kick_user_from_room(
     if kick_user is None:
         raise HTTPException(404, "User to kick not found in room")
     await room.players.remove(kick_user)
+    await sync_room(room.id)
     return await RoomData.from_tortoise_orm(room)
 
 
@@ -266,6 +470,8 @@ async def set_user_room_owner(
     if new_owner_user is None:
         raise HTTPException(404, "User to set owner not found in room")
     room.owner = new_owner_user
+    await room.save(update_fields=["owner_id"])
+    await sync_room(room.id)
     return await RoomData.from_tortoise_orm(room)
 
 
@@ -285,7 +491,9 @@ async def leave_from_room(
     # Когда выходит создатель, вся комната завершается
     if user == room.owner:
         room.status = RoomState.ended
-        await room.save()
+        await room.save(update_fields=["status"])
+        await end_session(room.id)
     else:
         await room.players.remove(room_user)
+    await sync_room(room.id)
     return await RoomData.from_tortoise_orm(room)
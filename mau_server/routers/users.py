@@ -14,29 +14,85 @@
 - TODO: Отдельные методы для получения истории игр.
 """
 
+from collections.abc import AsyncIterator
 from typing import Annotated
 
-import bcrypt
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from loguru import logger
 from tortoise.exceptions import IntegrityError
 
-from mau_server.config import stm
+from mau_server.config import hasher, leaderboard, stm
 from mau_server.models import User
 from mau_server.schemes.db import UserData
 from mau_server.schemes.users import (
     ChangePasswordDataIn,
     EditUserDataIn,
     UserDataIn,
+    UserPage,
 )
+from mau_server.services.pagination import decode_cursor, encode_cursor
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+# Имена, совпадающие с путями маршрутов `/users/...`.
+# Профиль пользователя с таким именем нельзя было бы получить.
+RESERVED_USERNAMES = frozenset({"me", "stream"})
+
+
+async def users_page(username: str | None, limit: int) -> list[UserData]:
+    """Получает пользователей, идущих по имени после `username`."""
+    query = User.all()
+    if username is not None:
+        query = query.filter(username__gt=username)
+    return await UserData.from_queryset(query.order_by("username").limit(limit))
+
 
 @router.get("/")
-async def get_users() -> list[UserData]:
-    """Получает всех пользователей из базы данных."""
-    return await UserData.from_queryset(User.all())
+async def get_users(
+    cursor: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+) -> UserPage:
+    """Получает страницу пользователей, упорядоченных по имени.
+
+    Чтобы получить следующую страницу, передайте курсор из ответа.
+    """
+    username = None
+    if cursor is not None:
+        username = decode_cursor(cursor, 1)[0]
+        if not isinstance(username, str):
+            raise HTTPException(400, "Invalid cursor")
+    users = await users_page(username, limit + 1)
+    if len(users) <= limit:
+        return UserPage(users=users, cursor=None)
+
+    users = users[:limit]
+    return UserPage(users=users, cursor=encode_cursor(users[-1].username))
+
+
+@router.get("/stream")
+async def stream_users(
+    chunk_size: int = Query(default=500, ge=1, le=5000),
+) -> StreamingResponse:
+    """Выгружает всех пользователей построчно в формате NDJSON.
+
+    Пользователи читаются из базы данных пачками по `chunk_size` и
+    отправляются по мере чтения, поэтому в памяти сервера не бывает
+    больше одной пачки.
+    """
+
+    async def lines() -> AsyncIterator[str]:
+        username = None
+        while True:
+            users = await users_page(username, chunk_size)
+            if not users:
+                return
+            yield "".join(user.model_dump_json() + "\n" for user in users)
+            if len(users) < chunk_size:
+                return
+            username = users[-1].username
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 # Регистрация пользователя
@@ -48,14 +104,13 @@ async def register_user(
     user: Annotated[UserDataIn, "Данные для регистрации"],
 ) -> UserData:
     """Регистрирует нового пользователя."""
+    if user.username in RESERVED_USERNAMES:
+        raise HTTPException(409, "Incorrect username")
     try:
         new_user = await User.create(
             username=user.username,
             name=user.username,
-            password_hash=str(
-                bcrypt.hashpw(bytes(user.password, "utf-8"), bcrypt.gensalt()),
-                "utf-8",
-            ),
+            password_hash=await hasher.hash(user.password),
         )
     except IntegrityError as e:
         logger.exception(e)
@@ -64,6 +119,7 @@ async def register_user(
         logger.exception(e)
         raise HTTPException(500, "Error while create new user")
 
+    await leaderboard.update(new_user)
     return await UserData.from_tortoise_orm(new_user)
 
 
@@ -77,18 +133,11 @@ async def change_my_password(
     Для смены пароля требуется подтвердить личность при помощи токена.
     Также требуется сопоставить данные со старым паролем.
     """
-    if not bcrypt.checkpw(
-        bytes(password_data.old_password, "utf-8"),
-        bytes(user.password_hash, "utf-8"),
-    ):
+    if not await hasher.verify(password_data.old_password, user.password_hash):
         raise HTTPException(401, "Invalid password")
-    user.password_hash = str(
-        bcrypt.hashpw(
-            bytes(password_data.new_password, "utf-8"), bcrypt.gensalt()
-        ),
-        "utf-8",
-    )
-    await user.save()
+    user.password_hash = await hasher.hash(password_data.new_password)
+    await user.save(update_fields=["password_hash"])
+    stm.invalidate(user)
     return await UserData.from_tortoise_orm(user)
 
 
@@ -96,18 +145,24 @@ async def change_my_password(
 async def login_user(
     userdata: Annotated[UserDataIn, "Данные для входа"],
 ) -> dict[str, str]:
-    """Получает новый токен для пользователя."""
+    """Получает новый токен для пользователя.
+
+    Если пароль был захеширован с устаревшей сложностью, хеш будет
+    незаметно пересчитан.
+    """
     user = await User.get_or_none(username=userdata.username)
     if user is None:
         raise HTTPException(401, "Incorrect user or password")
 
-    if bcrypt.checkpw(
-        bytes(userdata.password, "utf-8"), bytes(user.password_hash, "utf-8")
-    ):
-        return {"status": "ok", "token": stm.new_token(user)}
-    else:
+    if not await hasher.verify(userdata.password, user.password_hash):
         raise HTTPException(401, "Incorrect user or password")
 
+    if hasher.needs_rehash(user.password_hash):
+        user.password_hash = await hasher.hash(userdata.password)
+        await user.save(update_fields=["password_hash"])
+        stm.invalidate(user)
+    return {"status": "ok", "token": stm.new_token(user)}
+
 
 @router.get("/me")
 async def get_my_profile(user: User = Depends(stm.read_token)) -> UserData:
@@ -123,10 +178,19 @@ async def edit_my_profile(
     edit_user: EditUserDataIn, user: User = Depends(stm.read_token)
 ) -> UserData:
     """Изменяет основные данные пользователя."""
-    user.update_from_dict(
-        edit_user.model_dump(exclude_unset=True, exclude_none=True)
-    )
-    await user.save()
+    if edit_user.username in RESERVED_USERNAMES:
+        raise HTTPException(409, "Incorrect username")
+    stm.invalidate(user)
+    old_username = user.username
+    update = edit_user.model_dump(exclude_unset=True, exclude_none=True)
+    # Пользователь мог прийти из кеша токенов, поэтому сохраняются
+    # только изменённые поля, а статистика загружается заново
+    user.update_from_dict(update)
+    if update:
+        await user.save(update_fields=list(update))
+    if user.username != old_username:
+        await user.refresh_from_db()
+        await leaderboard.rename(old_username, user)
     return await UserData.from_tortoise_orm(user)
 
 
@@ -21,30 +21,49 @@ from mau_server.models import Game, Room, User
 # Как например пользователи в модели подсписок
 Tortoise.init_models(["mau_server.models"], "models")
 
+# Связи пользователя не попадают в схемы ответов.
+# Каждая связь, в том числе вложенная, загружается отдельным запросом,
+# а списки игр и комнат пользователя растут без ограничений.
+USER_RELATIONS = ("my_games", "lose_games", "win_games", "my_rooms", "rooms")
+
 # Данные модели были конвертированные из TortoiseORM и доступны всем.
+# Профиль пользователя без связей, загружается одним запросом.
 UserData = pydantic_model_creator(
-    User, name="UserData", exclude=("id", "password_hash")
+    User, name="UserData", exclude=("id", "password_hash", *USER_RELATIONS)
 )
 
 # Более сокращённая версия данных пользователя
 UserMinData = pydantic_model_creator(
-    User,
-    name="UserData",
+    User, name="UserMinData", include=("username", "name", "avatar_url")
+)
+
+# Подробная комната вместе с владельцем и игроками, по запросу на
+# каждую связь.
+# История игр комнаты и пароль в ответ не попадают.
+RoomData = pydantic_model_creator(
+    Room,
+    name="RoomData",
     exclude=(
-        "id",
         "password_hash",
-        "my_games",
-        "lose_games",
-        "win_games",
-        "my_rooms",
-        "rooms",
+        "games",
+        *(
+            f"{field}.{name}"
+            for field in ("owner", "players")
+            for name in ("password_hash", *USER_RELATIONS)
+        ),
     ),
 )
 
-
-RoomData = pydantic_model_creator(
+# Комната в списке комнат только с владельцем, без списка игроков.
+# Страница комнат загружается двумя запросами независимо от размера.
+RoomListData = pydantic_model_creator(
     Room,
-    name="RoomData",
-    exclude=("owner.password_hash", "players.password_hash"),
+    name="RoomListData",
+    exclude=(
+        "password_hash",
+        "games",
+        "players",
+        *(f"owner.{name}" for name in ("password_hash", *USER_RELATIONS)),
+    ),
 )
 GameData = pydantic_model_creator(Game, name="GameData")
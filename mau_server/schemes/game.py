@@ -1,14 +1,23 @@
-"""Схемы, используемые во время игры."""
+"""Схемы, используемые во время игры.
+
+Состояние игры отправляется клиентам на каждый ход и каждое событие.
+Поэтому помимо преобразования в схемы здесь есть быстрое кодирование
+состояния сразу в JSON, без создания и проверки схем.
+Схемы остаются описанием формата ответов для документации.
+"""
 
 from dataclasses import dataclass
 from datetime import datetime
+from enum import StrEnum
+from typing import Any
+from uuid import UUID, uuid4
 
 from mau.deck.card import MauCard
-from mau.deck.deck import Deck
 from mau.enums import CardColor, GameState
 from mau.game.game import MauGame
-from mau.game.player import Player, SortedCards
+from mau.game.player import Player
 from pydantic import BaseModel
+from pydantic_core import to_json
 
 from mau_server.models import Room, User
 from mau_server.schemes.roomlist import RoomMode
@@ -95,6 +104,138 @@ class GameData(BaseModel):
     state: GameState
 
 
+class PlayerDelta(BaseModel):
+    """Изменённые поля одного игрока.
+
+    - user_id: Какого игрока коснулись изменения.
+    - changes: Новые значения только изменившихся полей.
+    """
+
+    user_id: str
+    changes: dict[str, Any]
+
+
+class GameDelta(BaseModel):
+    """Изменения состояния игры относительно предыдущей версии.
+
+    Клиент применяет изменения только если его версия совпадает с
+    `base`.
+    Иначе клиент пропустил часть событий и должен получить полное
+    состояние игры заново.
+
+    - base: Версия, относительно которой посчитаны изменения.
+    - version: Версия состояния после применения изменений.
+    - fields: Новые значения изменившихся полей `GameData`.
+    - players: Изменения игроков в списках `players`, `winners` и
+      `losers`, если состав списка не поменялся.
+    """
+
+    base: int
+    version: int
+    fields: dict[str, Any]
+    players: dict[str, list[PlayerDelta]]
+
+
+class GameResult(BaseModel):
+    """Итоги завершённой игры.
+
+    Сохраняются в базу данных в фоне уже после ответа игроку.
+
+    - id: ID будущей записи игры.
+    - room_id: В какой комнате проходила игра.
+    - owner: Имя пользователя создателя игры.
+    - game_started: Когда игра началась.
+    - game_ended: Когда игра закончилась.
+    - winners: Имена пользователей победителей.
+    - losers: Имена пользователей проигравших.
+    - cards: Сколько карт осталось на руках у каждого участника.
+    """
+
+    id: UUID
+    room_id: UUID
+    owner: str
+    game_started: datetime
+    game_ended: datetime
+    winners: list[str]
+    losers: list[str]
+    cards: dict[str, int]
+
+
+# Текущая версия формата снимка игры
+SNAPSHOT_FORMAT = 3
+
+
+class PlayerSnapshot(BaseModel):
+    """Сохранённое состояние игрока.
+
+    - user_id: ID игрока.
+    - name: Имя игрока.
+    - hand: Упакованные карты в руке игрока.
+    - shotgun_current: Сколько раз игрок стрелял из револьвера.
+    - shotgun_lose: На каком выстреле игрок проиграет.
+    """
+
+    user_id: str
+    name: str
+    hand: list[str]
+    shotgun_current: int
+    shotgun_lose: int
+
+
+class GameSnapshot(BaseModel):
+    """Сохранённое состояние игры для восстановления после перезапуска.
+
+    Хранит только данные, без объектов движка, поэтому снимок можно
+    безопасно прочитать из любого источника.
+    Карты хранятся в упакованном виде `MauCard.pack`.
+
+    - format: Версия формата снимка, `SNAPSHOT_FORMAT`.
+    - rules: Правила игры и включены ли они.
+    - room_id: ID комнаты игры.
+    - owner_id: ID создателя игры.
+    - owner_name: Имя создателя игры.
+    - started: Началась ли игра.
+    - game_started: Когда игра началась.
+    - turn_started: Когда начался текущий ход.
+    - players: Игроки в порядке хода.
+    - winners: Победители в порядке выхода из игры.
+    - losers: Проигравшие в порядке выхода из игры.
+    - current_player: Номер текущего игрока.
+    - deck: Карты в колоде.
+    - used: Сыгранные карты.
+    - top: Верхняя карта колоды.
+    - reverse: Обратный порядок хода.
+    - take_counter: Сколько карт нужно взять.
+    - shotgun_current: Сколько раз стреляли из общего револьвера.
+    - shotgun_lose: На каком выстреле общего револьвера проигрыш.
+    - state: Состояние игры.
+    - bluff_player: ID игрока, которого можно проверить на блеф, и
+      блефовал ли он.
+    """
+
+    format: int = SNAPSHOT_FORMAT
+    rules: list[tuple[str, bool]]
+    room_id: str
+    owner_id: str
+    owner_name: str
+    started: bool
+    game_started: datetime
+    turn_started: datetime
+    players: list[PlayerSnapshot]
+    winners: list[PlayerSnapshot]
+    losers: list[PlayerSnapshot]
+    current_player: int
+    deck: list[str]
+    used: list[str]
+    top: str | None
+    reverse: bool
+    take_counter: int
+    shotgun_current: int
+    shotgun_lose: int
+    state: GameState
+    bluff_player: tuple[str, bool] | None
+
+
 @dataclass(slots=True)
 class GameContext:
     """Игровой контекст."""
@@ -103,109 +244,245 @@ class GameContext:
     room: Room
     game: MauGame | None
     player: Player | None
+    version: int = 0
 
 
 class ContextData(BaseModel):
-    """Отправляемая схема контекста."""
+    """Отправляемая схема контекста.
+
+    Версия состояния позволяет клиенту продолжить применять изменения
+    из событий после получения полного состояния игры.
+    """
 
     game: GameData | None
     player: PlayerData | None
+    version: int
 
 
-# конвертация моделей
-# ===================
+class CommandAction(StrEnum):
+    """Игровые действия, доступные через веб сокет комнаты."""
 
+    card = "card"
+    take = "take"
+    bluff = "bluff"
+    color = "color"
+    player = "player"
+    shotgun_take = "shotgun_take"
+    shotgun_shot = "shotgun_shot"
+    next = "next"
+    skip = "skip"
 
-def dump_card(card: MauCard) -> CardData:
-    """Преобразуем экземпляр карты в её схему."""
-    return CardData(
-        color=card.color,
-        behavior=card.behavior.name,
-        value=card.value,
-        cost=card.cost,
-    )
 
+class GameCommand(BaseModel):
+    """Игровая команда от клиента через веб сокет комнаты.
 
-def dump_deck(deck: Deck) -> CardDeckData:
-    """Преобразует колоду карт в схему, оставляя только количество карт."""
-    return CardDeckData(
-        top=dump_card(deck._top) if deck._top else None,
-        cards=len(deck.cards),
-        used=len(deck.used_cards),
-    )
+    - id: Номер запроса, возвращается в ответе на команду.
+    - action: Какое действие выполнить.
+    - args: Параметры действия, как в соответствующем маршруте:
+      `card` для `card`, `color` для `color`, `user_id` для `player`.
+    """
 
+    id: int | str
+    action: CommandAction
+    args: dict[str, str] = {}
 
-def dump_cover_cards(player_hand: SortedCards) -> CoverCardsData:
-    """Перегоняет сортированные карты в схему."""
-    return CoverCardsData(
-        cover=[dump_card(card) for card in player_hand.cover],
-        uncover=[dump_card(card) for card in player_hand.uncover],
-    )
 
+class CommandAck(BaseModel):
+    """Ответ на игровую команду.
 
-def dump_player(player: Player, show_cards: bool | None = False) -> PlayerData:
-    """Преобразует игрока в схему.
-
-    Пропускает поле `shotgun_lose`, чтобы не подсматривали.
-    Также если `show_cards` не установлен, отобразит только количество
-    карт.
+    - id: Номер запроса из команды.
+    - ok: Выполнена ли команда.
+    - context: Игровой контекст после выполнения команды.
+    - status: Код ошибки, как у соответствующего маршрута.
+    - detail: Описание ошибки.
     """
-    return PlayerData(
-        user_id=player.user_id,
-        name=player.name,
-        hand=dump_cover_cards(player.cover_cards())
-        if show_cards
-        else len(player.hand),
-        shotgun_current=player.shotgun.cur,
-    )
 
+    id: int | str | None
+    ok: bool
+    context: ContextData | None = None
+    status: int | None = None
+    detail: str | None = None
 
-def dump_rule(name: str, status: bool) -> RoomMode:
-    """Преобразует игровое правило в схему."""
-    return RoomMode(name=name, status=status)
+
+# конвертация моделей
+# ===================
+
+
+def dump_result(game: MauGame, room_id: UUID) -> GameResult:
+    """Собирает итоги игры для сохранения."""
+    return GameResult(
+        id=uuid4(),
+        room_id=room_id,
+        owner=game.owner.user_id,
+        game_started=game.game_start,
+        game_ended=datetime.now(),
+        winners=[pl.user_id for pl in game.pm.iter(game.pm.winners)],
+        losers=[pl.user_id for pl in game.pm.iter(game.pm.losers)],
+        cards={
+            pl.user_id: len(pl.hand)
+            for pl in (
+                *game.pm.iter(game.pm._players),
+                *game.pm.iter(game.pm.winners),
+                *game.pm.iter(game.pm.losers),
+            )
+        },
+    )
 
 
-def dump_bluff(
-    bluff: tuple[Player, bool] | None,
-) -> tuple[PlayerData, bool] | None:
-    """Запаковывает флаг блефа."""
-    if bluff is None:
-        return None
-    return (dump_player(bluff[0]), bluff[1])
+def dump_player_snapshot(player: Player) -> PlayerSnapshot:
+    """Сохраняет состояние игрока."""
+    return PlayerSnapshot(
+        user_id=player.user_id,
+        name=player.name,
+        hand=[card.pack() for card in player.hand],
+        shotgun_current=player.shotgun.cur,
+        shotgun_lose=player.shotgun.lose,
+    )
 
 
-def dump_game(game: MauGame) -> GameData:
-    """Преобразует игру в схему."""
-    return GameData(
+def dump_snapshot(game: MauGame) -> GameSnapshot:
+    """Сохраняет состояние игры."""
+    bluff = game.bluff_player
+    return GameSnapshot(
+        rules=list(game.rules.iter_rules()),
         room_id=game.room_id,
-        rules=[
-            dump_rule(name, status) for name, status in game.rules.iter_rules()
-        ],
         owner_id=game.owner.user_id,
+        owner_name=game.owner.name,
+        started=game.started,
         game_started=game.game_start,
         turn_started=game.turn_start,
         players=[
-            dump_player(player) for player in game.pm.iter(game.pm._players)
+            dump_player_snapshot(pl) for pl in game.pm.iter(game.pm._players)
         ],
         winners=[
-            dump_player(player) for player in game.pm.iter(game.pm.winners)
+            dump_player_snapshot(pl) for pl in game.pm.iter(game.pm.winners)
+        ],
+        losers=[
+            dump_player_snapshot(pl) for pl in game.pm.iter(game.pm.losers)
         ],
-        losers=[dump_player(player) for player in game.pm.iter(game.pm.losers)],
         current_player=game.pm._cp,
-        deck=dump_deck(game.deck),
+        deck=[card.pack() for card in game.deck.cards],
+        used=[card.pack() for card in game.deck.used_cards],
+        top=game.deck._top.pack() if game.deck._top else None,
         reverse=game.reverse,
         take_counter=game.take_counter,
         shotgun_current=game.shotgun.cur,
+        shotgun_lose=game.shotgun.lose,
         state=game.state,
-        bluff_player=dump_bluff(game.bluff_player),
+        bluff_player=None if bluff is None else (bluff[0].user_id, bluff[1]),
     )
 
 
-async def dump_context(ctx: GameContext) -> ContextData:
-    """Преобразует игровой контекст в схему."""
-    return ContextData(
-        game=None if ctx.game is None else dump_game(ctx.game),
-        player=None
-        if ctx.player is None
-        else dump_player(ctx.player, show_cards=True),
+# Быстрое кодирование состояния
+# =============================
+
+# Различных карт немного, поэтому представление каждой карты создаётся
+# один раз и переиспользуется всеми колодами и руками игроков
+_CARDS: dict[tuple[CardColor, str, int, int], dict[str, Any]] = {}
+# Уже закодированные в JSON карты, из них собираются руки игроков
+_CARDS_JSON: dict[tuple[CardColor, str, int, int], bytes] = {}
+
+
+def card_state(card: MauCard) -> dict[str, Any]:
+    """Получает общее представление карты в формате `CardData`.
+
+    Одинаковые карты получают один и тот же словарь, поэтому его
+    нельзя изменять.
+    """
+    key = (card.color, card.behavior.name, card.value, card.cost)
+    state = _CARDS.get(key)
+    if state is None:
+        state = _CARDS[key] = {
+            "color": card.color,
+            "behavior": card.behavior.name,
+            "value": card.value,
+            "cost": card.cost,
+        }
+    return state
+
+
+def card_json(card: MauCard) -> bytes:
+    """Получает карту, уже закодированную в JSON."""
+    key = (card.color, card.behavior.name, card.value, card.cost)
+    data = _CARDS_JSON.get(key)
+    if data is None:
+        data = _CARDS_JSON[key] = encode(card_state(card))
+    return data
+
+
+def encode_hand(player: Player) -> bytes:
+    """Кодирует руку игрока в JSON формата `CoverCardsData`.
+
+    Рука склеивается из заранее закодированных карт, без сборки и
+    кодирования словаря на каждую карту.
+    """
+    cards = player.cover_cards()
+    return b'{"cover":[%b],"uncover":[%b]}' % (
+        b",".join(card_json(card) for card in cards.cover),
+        b",".join(card_json(card) for card in cards.uncover),
     )
+
+
+def hand_state(player: Player) -> dict[str, Any]:
+    """Получает руку игрока в формате `CoverCardsData`."""
+    cards = player.cover_cards()
+    return {
+        "cover": [card_state(card) for card in cards.cover],
+        "uncover": [card_state(card) for card in cards.uncover],
+    }
+
+
+def player_state(player: Player, show_cards: bool = False) -> dict[str, Any]:
+    """Получает представление игрока в формате `PlayerData`."""
+    return {
+        "user_id": player.user_id,
+        "name": player.name,
+        "hand": hand_state(player) if show_cards else len(player.hand),
+        "shotgun_current": player.shotgun.cur,
+    }
+
+
+def game_state(game: MauGame) -> dict[str, Any]:
+    """Получает представление игры в формате `GameData`.
+
+    Значения не приводятся к JSON: даты и перечисления остаются
+    объектами Python, их кодирует уже `encode`.
+    """
+    bluff = game.bluff_player
+    return {
+        "room_id": game.room_id,
+        "rules": [
+            {"name": name, "status": status}
+            for name, status in game.rules.iter_rules()
+        ],
+        "owner_id": game.owner.user_id,
+        "game_started": game.game_start,
+        "turn_started": game.turn_start,
+        "players": [
+            player_state(player) for player in game.pm.iter(game.pm._players)
+        ],
+        "winners": [
+            player_state(player) for player in game.pm.iter(game.pm.winners)
+        ],
+        "losers": [
+            player_state(player) for player in game.pm.iter(game.pm.losers)
+        ],
+        "current_player": game.pm._cp,
+        "deck": {
+            "top": card_state(game.deck._top) if game.deck._top else None,
+            "cards": len(game.deck.cards),
+            "used": len(game.deck.used_cards),
+        },
+        "reverse": game.reverse,
+        "bluff_player": None
+        if bluff is None
+        else (player_state(bluff[0]), bluff[1]),
+        "take_counter": game.take_counter,
+        "shotgun_current": game.shotgun.cur,
+        "state": game.state,
+    }
+
+
+def encode(state: Any) -> bytes:  # noqa: ANN401
+    """Кодирует представление состояния в JSON."""
+    return to_json(state)
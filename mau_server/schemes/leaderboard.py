@@ -0,0 +1,28 @@
+"""Схемы таблицы лидеров."""
+
+from enum import StrEnum
+
+from pydantic import BaseModel
+
+
+class CategoryEnum(StrEnum):
+    """Все используемые категории в таблице лидеров.
+
+    Название каждой категории совпадает с полем пользователя.
+    `cards` - сколько всего карт осталось на руках в конце сыгранных
+    игр, в этой категории выше тот, у кого карт меньше.
+    Пользователи без сыгранных игр в эту категорию не попадают.
+    """
+
+    gems = "gems"
+    play_count = "games"
+    win_count = "wins"
+    cards_count = "cards"
+
+
+class LeaderboardEntry(BaseModel):
+    """Место пользователя в таблице лидеров."""
+
+    username: str
+    position: int
+    value: int
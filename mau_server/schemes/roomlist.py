@@ -3,10 +3,48 @@
 Используются при взаимодействии с комнатами
 """
 
+from enum import StrEnum
 from uuid import UUID
 
 from pydantic import BaseModel
 
+from mau_server.models import RoomState
+from mau_server.schemes.db import RoomListData
+
+
+class RoomOrder(StrEnum):
+    """Поля, по которым можно сортировать список комнат."""
+
+    create_time = "create_time"
+    gems = "gems"
+    max_players = "max_players"
+
+
+class RoomFilter(BaseModel):
+    """Фильтры списка открытых комнат.
+
+    - min_capacity: Наименьшая вместимость комнаты (`max_players`).
+    - max_capacity: Наибольшая вместимость комнаты (`max_players`).
+    - max_gems: Наибольшая стоимость входа в комнату.
+    - free_seats: Только комнаты со свободными местами.
+    """
+
+    min_capacity: int | None = None
+    max_capacity: int | None = None
+    max_gems: int | None = None
+    free_seats: bool = False
+
+
+class RoomPage(BaseModel):
+    """Страница списка комнат.
+
+    - rooms: Комнаты на текущей странице, без списка игроков.
+    - cursor: Курсор следующей страницы, если она есть.
+    """
+
+    rooms: list[RoomListData]
+    cursor: str | None
+
 
 class RoomMode(BaseModel):
     """Режим игры, изменяющий правила."""
@@ -36,3 +74,51 @@ class RoomDataIn(BaseModel):
     gems: int | None = None
     max_players: int | None = None
     min_players: int | None = None
+
+
+class RoomEntry(BaseModel):
+    """Краткая информация о комнате в каталоге.
+
+    - id: ID комнаты.
+    - name: Название комнаты.
+    - owner: Имя пользователя владельца комнаты.
+    - players: Сколько игроков сейчас в комнате.
+    - min_players: Сколько игроков нужно для начала игры.
+    - max_players: Сколько игроков вмещает комната.
+    - gems: Стоимость входа в комнату.
+    - status: Текущее состояние комнаты.
+    """
+
+    id: UUID
+    name: str
+    owner: str
+    players: int
+    min_players: int
+    max_players: int
+    gems: int
+    status: RoomState
+
+
+class LobbyEventType(StrEnum):
+    """Типы событий каталога комнат."""
+
+    snapshot = "snapshot"
+    add = "add"
+    update = "update"
+    remove = "remove"
+
+
+class LobbyEvent(BaseModel):
+    """Событие каталога комнат.
+
+    Сразу после подключения клиент получает весь каталог, а затем
+    только изменения отдельных комнат.
+
+    - event: Тип события.
+    - rooms: Весь каталог или добавленная/изменённая комната.
+    - room_id: ID удалённой комнаты.
+    """
+
+    event: LobbyEventType
+    rooms: list[RoomEntry] = []
+    room_id: UUID | None = None
@@ -2,6 +2,8 @@
 
 from pydantic import BaseModel, Field
 
+from mau_server.schemes.db import UserData
+
 
 class UserDataIn(BaseModel):
     """Данные для регистрации/входа нового пользователя.
@@ -35,3 +37,14 @@ class EditUserDataIn(BaseModel):
     username: str | None = Field(default=None, max_length=16)
     name: str | None = Field(default=None, min_length=4, max_length=64)
     avatar_url: str | None = None
+
+
+class UserPage(BaseModel):
+    """Страница списка пользователей.
+
+    - users: Пользователи страницы.
+    - cursor: Курсор следующей страницы, если она есть.
+    """
+
+    users: list[UserData]
+    cursor: str | None
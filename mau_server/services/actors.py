@@ -0,0 +1,129 @@
+"""Последовательное выполнение игровых команд в комнате.
+
+Игровые маршруты изменяют общий объект игры и могут ожидать
+Redis или базу данных посреди изменения.
+Если два запроса к одной комнате выполняются одновременно, их
+изменения могут перемешаться.
+
+Поэтому у каждой комнаты есть свой почтовый ящик команд, который
+разбирает одна задача.
+Команды одной комнаты выполняются строго по очереди и без
+блокировок, а разные комнаты работают независимо.
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+from fastapi import HTTPException
+
+_T = TypeVar("_T")
+
+_Command = tuple[Callable[[], Awaitable[Any]], asyncio.Future[Any], float]
+
+
+class RoomActors:
+    """Выполняет команды каждой комнаты в отдельной задаче.
+
+    Задача комнаты создаётся при первой команде и завершается, если
+    комната долго не получала команд.
+    Если очередь команд комнаты переполнена, запрос сразу получит
+    ошибку вместо бесконечного ожидания.
+
+    :param queue_size: Сколько команд комнаты может ждать выполнения.
+    :type queue_size: int
+    :param idle_time: Через сколько секунд без команд завершать задачу
+        комнаты.
+    :type idle_time: float
+    """
+
+    def __init__(self, queue_size: int = 64, idle_time: float = 30.0) -> None:
+        self._queue_size = queue_size
+        self._idle_time = idle_time
+        self._mailboxes: dict[str, asyncio.Queue[_Command]] = {}
+        self._workers: dict[str, asyncio.Task[None]] = {}
+
+        self.commands = 0
+        self.rejected = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    async def run(
+        self, room_id: str, command: Callable[[], Awaitable[_T]]
+    ) -> _T:
+        """Выполняет команду в очереди комнаты и ждёт её результата."""
+        mailbox = self._mailboxes.get(room_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[room_id] = asyncio.Queue(self._queue_size)
+            self._workers[room_id] = asyncio.get_running_loop().create_task(
+                self._work(room_id, mailbox)
+            )
+
+        future: asyncio.Future[_T] = asyncio.get_running_loop().create_future()
+        try:
+            mailbox.put_nowait((command, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(503, "Too many commands for this room")
+        return await future
+
+    async def _work(
+        self, room_id: str, mailbox: asyncio.Queue[_Command]
+    ) -> None:
+        while True:
+            try:
+                command, future, queued = await asyncio.wait_for(
+                    mailbox.get(), self._idle_time
+                )
+            except TimeoutError:
+                if mailbox.empty():
+                    self._mailboxes.pop(room_id, None)
+                    self._workers.pop(room_id, None)
+                    return
+                continue
+
+            # Запрос уже отменён, пока команда ждала в очереди
+            if future.done():
+                continue
+
+            try:
+                result = await command()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+            latency = time.perf_counter() - queued
+            self.commands += 1
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    async def stop(self) -> None:
+        """Останавливает задачи всех комнат."""
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._mailboxes.clear()
+
+    def depths(self) -> dict[str, float]:
+        """Получает количество ожидающих команд в каждой комнате."""
+        return {
+            room_id: mailbox.qsize()
+            for room_id, mailbox in self._mailboxes.items()
+        }
+
+    def stats(self) -> dict[str, float]:
+        """Получает количество комнат и время выполнения команд."""
+        return {
+            "rooms": len(self._workers),
+            "commands": self.commands,
+            "rejected": self.rejected,
+            "avg_latency_ms": self.latency / self.commands * 1000
+            if self.commands
+            else 0,
+            "max_latency_ms": self.max_latency * 1000,
+        }
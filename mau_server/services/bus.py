@@ -0,0 +1,170 @@
+"""Шина игровых событий поверх Redis.
+
+Позволяет запускать сервер сразу в нескольких процессах.
+Игровые события публикуются в отдельный канал комнаты.
+Каждый процесс подписывается на каналы только тех комнат, за которыми
+наблюдают его собственные клиенты, и пересылает им полученные события.
+Своим клиентам процесс отправляет события сразу, поэтому свои же
+события из канала он пропускает.
+
+Помимо событий комнат шина передаёт служебные уведомления, например
+об изменении закреплённых за процессами комнат.
+На служебные каналы подписаны все процессы.
+"""
+
+import asyncio
+from collections.abc import Callable
+from uuid import uuid4
+
+from loguru import logger
+from redis.asyncio.client import Redis
+
+
+class RedisEventBus:
+    """Распространяет уже сериализованные события между процессами.
+
+    Публикация не блокирует отправителя: кадры складываются в очередь
+    и отправляются одной задачей, чтобы сохранить порядок событий.
+
+    :param redis: Клиент Redis, через который идёт обмен событиями.
+    :type redis: Redis
+    :param queue_size: Сколько событий может ждать публикации.
+    :type queue_size: int
+    :param poll_timeout: Как долго ждать новое сообщение из канала.
+    :type poll_timeout: float
+    """
+
+    def __init__(
+        self, redis: Redis, queue_size: int = 1024, poll_timeout: float = 1.0
+    ) -> None:
+        self._redis = redis
+        self._pubsub = redis.pubsub()
+        self._outbox: asyncio.Queue[tuple[str, str]] = asyncio.Queue(queue_size)
+        self._handlers: dict[str, Callable[[str], None]] = {}
+        self._poll_timeout = poll_timeout
+        self._subscribed = asyncio.Event()
+        self._tasks: list[asyncio.Task[None]] = []
+        self._deliver: Callable[[str, str], None] | None = None
+        self._is_watched: Callable[[str], bool] | None = None
+        self._instance = uuid4().hex
+
+    @staticmethod
+    def channel(room_id: str) -> str:
+        """Получает название канала событий комнаты."""
+        return f"room:{room_id}:events"
+
+    @staticmethod
+    def room_id(channel: str) -> str:
+        """Получает ID комнаты из названия канала событий."""
+        return channel.split(":", 2)[1]
+
+    async def start(
+        self,
+        deliver: Callable[[str, str], None],
+        is_watched: Callable[[str], bool],
+    ) -> None:
+        """Запускает публикацию и прослушивание событий.
+
+        :param deliver: Отправляет полученный кадр локальным клиентам.
+        :type deliver: Callable[[str, str], None]
+        :param is_watched: Есть ли у процесса клиенты в комнате.
+        :type is_watched: Callable[[str], bool]
+        """
+        self._deliver = deliver
+        self._is_watched = is_watched
+        if self._handlers:
+            await self._pubsub.subscribe(*self._handlers)
+            self._subscribed.set()
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._publisher()),
+            loop.create_task(self._listener()),
+        ]
+
+    async def stop(self) -> None:
+        """Останавливает шину и отписывается от всех каналов."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._pubsub.aclose()
+
+    def listen(self, channel: str, handler: Callable[[str], None]) -> None:
+        """Подписывает обработчик на служебный канал.
+
+        Обработчики нужно добавить до запуска шины.
+        """
+        self._handlers[channel] = handler
+
+    def notify(self, channel: str, message: str) -> None:
+        """Ставит уведомление в очередь публикации в служебный канал."""
+        try:
+            self._outbox.put_nowait((channel, message))
+        except asyncio.QueueFull:
+            logger.warning("Event bus is full, drop message for {}", channel)
+
+    def publish(self, room_id: str, frame: str) -> None:
+        """Ставит кадр в очередь публикации в канал комнаты.
+
+        Кадр получат только клиенты других процессов.
+        """
+        try:
+            self._outbox.put_nowait(
+                (self.channel(room_id), f"{self._instance}:{frame}")
+            )
+        except asyncio.QueueFull:
+            logger.warning("Event bus is full, drop event for {}", room_id)
+
+    async def sync(self, room_id: str) -> None:
+        """Подписывается или отписывается от канала комнаты.
+
+        Решение принимается по текущему состоянию локальных клиентов,
+        поэтому порядок выполнения нескольких вызовов не важен.
+        Повторная подписка или отписка для Redis ничего не меняет.
+        """
+        if self._is_watched is None:
+            return
+        try:
+            if self._is_watched(room_id):
+                await self._pubsub.subscribe(self.channel(room_id))
+                self._subscribed.set()
+            else:
+                await self._pubsub.unsubscribe(self.channel(room_id))
+        except Exception as e:
+            logger.error("Failed to sync room {} channel: {}", room_id, e)
+
+    async def _publisher(self) -> None:
+        """Публикует события из очереди по порядку."""
+        while True:
+            channel, frame = await self._outbox.get()
+            try:
+                await self._redis.publish(channel, frame)
+            except Exception as e:
+                logger.error("Failed to publish event: {}", e)
+
+    async def _listener(self) -> None:
+        """Пересылает события из каналов локальным клиентам."""
+        while True:
+            if not self._pubsub.subscribed:
+                self._subscribed.clear()
+                await self._subscribed.wait()
+
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=self._poll_timeout,
+                )
+            except Exception as e:
+                logger.error("Failed to read event bus: {}", e)
+                await asyncio.sleep(self._poll_timeout)
+                continue
+
+            if message is None or self._deliver is None:
+                continue
+            handler = self._handlers.get(message["channel"])
+            if handler is not None:
+                handler(message["data"])
+                continue
+            instance, _, frame = message["data"].partition(":")
+            if instance != self._instance:
+                self._deliver(self.room_id(message["channel"]), frame)
@@ -0,0 +1,62 @@
+"""Вычисление изменений состояния игры между версиями.
+
+Вместо отправки полного состояния игры на каждое событие клиентам
+отправляются только изменившиеся поля.
+Состояния сравниваются в виде словарей `game_state` в формате схемы
+`GameData`.
+"""
+
+from typing import Any
+
+from mau_server.schemes.game import GameDelta, PlayerDelta
+
+# Списки игроков, которые сравниваются по каждому игроку отдельно
+PLAYER_LISTS = ("players", "winners", "losers")
+
+
+def diff_players(
+    old: list[dict[str, Any]], new: list[dict[str, Any]]
+) -> list[PlayerDelta] | None:
+    """Сравнивает два списка игроков.
+
+    Если состав или порядок игроков изменился, вернёт None.
+    В таком случае список игроков стоит отправить целиком.
+    """
+    if [pl["user_id"] for pl in old] != [pl["user_id"] for pl in new]:
+        return None
+
+    res = []
+    for old_player, new_player in zip(old, new, strict=True):
+        changes = {
+            key: value
+            for key, value in new_player.items()
+            if old_player.get(key) != value
+        }
+        if changes:
+            res.append(
+                PlayerDelta(user_id=new_player["user_id"], changes=changes)
+            )
+    return res
+
+
+def diff_game(
+    old: dict[str, Any], new: dict[str, Any], base: int, version: int
+) -> GameDelta:
+    """Вычисляет изменения между двумя состояниями игры."""
+    fields: dict[str, Any] = {}
+    players: dict[str, list[PlayerDelta]] = {}
+
+    for key, value in new.items():
+        old_value = old.get(key)
+        if old_value == value:
+            continue
+
+        if key in PLAYER_LISTS:
+            player_changes = diff_players(old_value or [], value)
+            if player_changes is not None:
+                players[key] = player_changes
+                continue
+
+        fields[key] = value
+
+    return GameDelta(base=base, version=version, fields=fields, players=players)
@@ -0,0 +1,32 @@
+"""Условные запросы по ETag.
+
+Клиенты без веб сокета периодически опрашивают состояние игры и
+комнаты.
+Каждый ответ помечается ETag, построенным из версии состояния.
+Если клиент прислал ETag текущей версии в `If-None-Match`, сервер
+отвечает 304 без тела и даже не собирает ответ.
+"""
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts: object) -> str:
+    """Собирает строгий ETag из частей версии состояния."""
+    return '"' + ".".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверяет, есть ли у клиента ответ с таким ETag."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in header.split(",")
+    )
+
+
+def not_modified(etag: str) -> Response:
+    """Ответ на запрос, если состояние не изменилось."""
+    return Response(status_code=304, headers={"ETag": etag})
@@ -1,14 +1,29 @@
 """Вспомогательный модуль отправки игровых событий."""
 
 import asyncio
+from collections.abc import Callable
+from enum import StrEnum
+from typing import Any
 
 from fastapi import WebSocket
 from loguru import logger
 from mau.enums import GameEvents
 from mau.events import BaseEventHandler, Event
+from mau.game.game import MauGame
 from pydantic import BaseModel
 
-from mau_server.schemes.game import GameData, PlayerData, dump_game, dump_player
+from mau_server.schemes.game import (
+    CoverCardsData,
+    GameData,
+    GameDelta,
+    PlayerData,
+    encode,
+    encode_hand,
+    game_state,
+    player_state,
+)
+from mau_server.services.bus import RedisEventBus
+from mau_server.services.delta import diff_game
 
 
 class EventData(BaseModel):
@@ -17,49 +32,443 @@ class EventData(BaseModel):
     - event_type: Тип произошедшего события.
     - from_player: Кто совершил данное событие.
     - data: Некоторая полезная информация.
-    - context: Текущий игровой контекст.
+    - version: Версия состояния игры после события.
+    - game: Полное состояние игры, если у клиентов ещё нет предыдущей
+      версии.
+    - delta: Изменения состояния игры относительно предыдущей версии.
     """
 
     event: GameEvents
     player: PlayerData
     data: str
-    game: GameData
+    version: int
+    game: GameData | None = None
+    delta: GameDelta | None = None
+
+
+class HandData(BaseModel):
+    """Рука игрока после события.
+
+    Отправляется только самому игроку и только если рука изменилась.
+
+    - event: Всегда `hand`.
+    - version: Версия состояния игры после события.
+    - hand: Карты в руке игрока.
+    """
+
+    event: str = "hand"
+    version: int
+    hand: CoverCardsData
+
+
+class OverflowPolicy(StrEnum):
+    """Что делать, если клиент не успевает забирать события.
+
+    - drop_oldest: Выбросить самое старое событие из очереди.
+    - disconnect: Отключить медленного клиента.
+    """
+
+    drop_oldest = "drop_oldest"
+    disconnect = "disconnect"
+
+
+class ClientConnection:
+    """Подключение клиента с ограниченной очередью отправки.
+
+    Все кадры для клиента складываются в очередь фиксированного размера.
+    Единственная задача-писатель по очереди отправляет их в сокет.
+    Так один медленный клиент не сможет накопить неограниченное
+    количество задач и кадров в памяти.
+
+    Если подключение принадлежит игроку, помимо общих событий он
+    получает и свою руку, когда та меняется.
+    """
+
+    def __init__(
+        self,
+        room_id: str,
+        websocket: WebSocket,
+        queue_size: int,
+        send_timeout: float,
+        policy: OverflowPolicy,
+    ) -> None:
+        self.room_id = room_id
+        self.user_id: str | None = None
+        self.hand: bytes | None = None
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(queue_size)
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self.writer: asyncio.Task[None] | None = None
+        self.closed = False
+
+    def put(self, frame: str) -> bool:
+        """Добавляет кадр в очередь отправки.
+
+        Вернёт False, если клиент переполнил очередь и согласно
+        политике его следует отключить.
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            if self.policy == OverflowPolicy.disconnect:
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+        return True
+
+    async def write(self) -> None:
+        """Отправляет кадры из очереди, пока клиент успевает их забирать.
+
+        Завершается, если отправка кадра не уложилась в отведённое
+        время или сокет был закрыт.
+        """
+        while True:
+            frame = await self.queue.get()
+            await asyncio.wait_for(
+                self.websocket.send_text(frame), self.send_timeout
+            )
 
 
 class WebSocketEventHandler(BaseEventHandler):
-    """Отправляет события клиентам через веб сокеты."""
+    """Отправляет события клиентам через веб сокеты.
+
+    :param queue_size: Сколько кадров может ждать отправки у клиента.
+    :type queue_size: int
+    :param send_timeout: Сколько секунд ждать отправки одного кадра.
+    :type send_timeout: float
+    :param policy: Что делать при переполнении очереди клиента.
+    :type policy: OverflowPolicy
+    :param bus: Шина для обмена событиями между процессами сервера.
+        Если не указана, события отправляются только клиентам процесса.
+    :type bus: RedisEventBus | None
+    """
 
-    def __init__(self) -> None:
-        self.clients: dict[str, list[WebSocket]] = {}
+    def __init__(
+        self,
+        queue_size: int = 64,
+        send_timeout: float = 5.0,
+        policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+        bus: RedisEventBus | None = None,
+    ) -> None:
+        self.clients: dict[str, list[ClientConnection]] = {}
         self.event_loop = asyncio.get_running_loop()
+        self._queue_size = queue_size
+        self._send_timeout = send_timeout
+        self._policy = policy
+        self._tasks: set[asyncio.Task[None]] = set()
+        self.versions: dict[str, int] = {}
+        self._states: dict[str, tuple[int, dict[str, Any]]] = {}
+        self._waiters: dict[str, asyncio.Event] = {}
+        # Вызывается при каждом изменении версии игры в комнате
+        self.on_touch: Callable[[str], None] | None = None
+        self.bus = bus
 
-    async def connect(self, room_id: str, websocket: WebSocket) -> None:
-        """Добавляет нового клиента."""
+    async def start(self) -> None:
+        """Запускает шину событий, если она используется."""
+        if self.bus is not None:
+            await self.bus.start(self.broadcast, self.clients.__contains__)
+
+    async def stop(self) -> None:
+        """Останавливает шину событий, если она используется."""
+        if self.bus is not None:
+            await self.bus.stop()
+
+    def _sync_bus(self, room_id: str) -> None:
+        """Обновляет подписку на канал комнаты в шине событий."""
+        if self.bus is None:
+            return
+        task = self.event_loop.create_task(self.bus.sync(room_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def connect(
+        self,
+        room_id: str,
+        websocket: WebSocket,
+        user_id: str | None = None,
+        greeting: Callable[[], str] | None = None,
+    ) -> ClientConnection:
+        """Добавляет нового клиента.
+
+        Если указан `user_id`, клиент будет получать руку этого игрока.
+        Кадр `greeting` собирается и ставится в очередь клиента до того,
+        как клиент начнёт получать события комнаты, поэтому ни одно
+        событие не обгонит его и не потеряется между ними.
+        """
         await websocket.accept()
+        connection = ClientConnection(
+            room_id,
+            websocket,
+            self._queue_size,
+            self._send_timeout,
+            self._policy,
+        )
+        connection.user_id = user_id
+        connection.writer = self.event_loop.create_task(
+            self._run_writer(connection)
+        )
+        if greeting is not None:
+            connection.put(greeting())
         if room_id not in self.clients:
             self.clients[room_id] = []
-        self.clients[room_id].append(websocket)
-        logger.info("New client, now {} clients", len(self.clients))
+            self._sync_bus(room_id)
+        self.clients[room_id].append(connection)
+        logger.info("New client, now {} rooms", len(self.clients))
+        return connection
 
     def disconnect(self, room_id: str, websocket: WebSocket) -> None:
         """Отключает клиента от комнаты."""
-        if websocket in self.clients[room_id]:
-            self.clients[room_id].remove(websocket)
-        logger.info("Client disconnect, now {} clients", len(self.clients))
+        for connection in self.clients.get(room_id, []):
+            if connection.websocket is websocket:
+                self._remove(connection)
+                break
+        logger.info("Client disconnect, now {} rooms", len(self.clients))
+
+    def _remove(self, connection: ClientConnection) -> None:
+        """Убирает подключение из комнаты и останавливает его писателя."""
+        connection.closed = True
+        room_clients = self.clients.get(connection.room_id, [])
+        if connection in room_clients:
+            room_clients.remove(connection)
+        if not room_clients and connection.room_id in self.clients:
+            self.clients.pop(connection.room_id)
+            self._sync_bus(connection.room_id)
+        if (
+            connection.writer is not None
+            and connection.writer is not asyncio.current_task()
+        ):
+            connection.writer.cancel()
+
+    def _evict(self, connection: ClientConnection) -> None:
+        """Отключает клиента, который не справляется с потоком событий."""
+        logger.warning("Evict slow client from room {}", connection.room_id)
+        self._remove(connection)
+        task = self.event_loop.create_task(self._close(connection))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close(self, connection: ClientConnection) -> None:
+        """Закрывает сокет отключённого клиента."""
+        try:
+            await asyncio.wait_for(
+                connection.websocket.close(code=1008), connection.send_timeout
+            )
+        except Exception as e:
+            logger.debug("Failed to close websocket: {}", e)
+
+    async def _run_writer(self, connection: ClientConnection) -> None:
+        """Запускает писателя клиента и отключает его при ошибке."""
+        try:
+            await connection.write()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Failed to send event: {!r}", e)
+            if not connection.closed:
+                self._evict(connection)
+
+    def broadcast(self, room_id: str, frame: str) -> None:
+        """Отправляет уже готовый кадр всем клиентам комнаты.
+
+        Кадр кодируется один раз и переиспользуется для каждого
+        подключения, вместо повторной сериализации на каждый сокет.
+        Кадр попадает в очередь каждого клиента, переполнившие
+        очередь клиенты отключаются согласно политике.
+        """
+        for connection in list(self.clients.get(room_id, [])):
+            if not connection.put(frame):
+                self._evict(connection)
+
+    def reply(self, connection: ClientConnection, frame: str) -> None:
+        """Отправляет кадр только одному клиенту.
+
+        Кадр встаёт в ту же очередь, что и события комнаты, поэтому
+        клиент получает их в порядке отправки.
+        """
+        if not connection.put(frame):
+            self._evict(connection)
+
+    def send(self, room_id: str, frame: str) -> None:
+        """Отправляет готовый кадр всем клиентам комнаты во всех процессах.
+
+        Клиенты текущего процесса получают кадр сразу, остальные через
+        шину событий, если она включена.
+        """
+        self.broadcast(room_id, frame)
+        if self.bus is not None:
+            self.bus.publish(room_id, frame)
+
+    def touch(self, room_id: str) -> int:
+        """Увеличивает версию состояния игры без отправки события.
+
+        Вызывается, когда игра изменилась в обход событий движка.
+        """
+        version = self.versions.get(room_id, 0) + 1
+        self.versions[room_id] = version
+        self._wake(room_id)
+        if self.on_touch is not None:
+            self.on_touch(room_id)
+        return version
+
+    def changed(self, room_id: str, game: MauGame, since: int) -> int:
+        """Отмечает изменение игры в обход событий движка.
+
+        Если с версии `since` движок уже отправил события, версия не
+        меняется: клиенты получили изменения вместе с событиями.
+        Иначе версия увеличивается, а состояние для следующих изменений
+        запоминается уже для новой версии, чтобы `base` следующего
+        события совпадал с версией, которую клиенты могли получить
+        в ответе маршрута.
+
+        :param room_id: ID комнаты игры.
+        :type room_id: str
+        :param game: Изменившаяся игра.
+        :type game: MauGame
+        :param since: Версия игры до изменения.
+        :type since: int
+        :return: Текущая версия игры.
+        :rtype: int
+        """
+        if self.version(room_id) != since:
+            return self.version(room_id)
+        version = self.touch(room_id)
+        if room_id in self._states:
+            self._states[room_id] = (version, game_state(game))
+        return version
+
+    def _wake(self, room_id: str) -> None:
+        """Будит все запросы, ждущие изменения игры в комнате."""
+        waiter = self._waiters.pop(room_id, None)
+        if waiter is not None:
+            waiter.set()
+
+    async def wait(self, room_id: str, version: int, wait_time: float) -> bool:
+        """Ждёт, пока версия игры в комнате не отличится от `version`.
+
+        Все ждущие запросы комнаты делят одно событие, поэтому
+        ожидание ничего не стоит, пока игра не изменится.
+        Вернёт False, если за `wait_time` секунд игра не изменилась.
+        """
+        if self.version(room_id) != version:
+            return True
+
+        waiter = self._waiters.get(room_id)
+        if waiter is None:
+            waiter = self._waiters[room_id] = asyncio.Event()
+        try:
+            await asyncio.wait_for(waiter.wait(), wait_time)
+        except TimeoutError:
+            return False
+        return True
+
+    def version(self, room_id: str) -> int:
+        """Получает текущую версию состояния игры в комнате."""
+        return self.versions.get(room_id, 0)
+
+    def forget(self, room_id: str) -> None:
+        """Забывает версии и состояние завершённой игры."""
+        self.versions.pop(room_id, None)
+        self._states.pop(room_id, None)
+        self._wake(room_id)
 
     def push(self, event: Event) -> None:
-        """Отправляет событие клиентам."""
-        event_data = EventData(
-            event=event.event_type,
-            player=dump_player(event.player),
-            data=event.data,
-            game=dump_game(event.game),
+        """Отправляет событие клиентам.
+
+        Каждое событие увеличивает версию состояния игры.
+        Клиентам отправляются только изменения относительно предыдущей
+        отправленной версии.
+        Если предыдущей версии нет, отправляется полное состояние игры.
+
+        Если за комнатой никто не наблюдает, событие даже не
+        сериализуется.
+        При работе через шину о наблюдателях в других процессах ничего
+        не известно, поэтому событие публикуется всегда.
+
+        Подключённые игроки дополнительно получают свою руку, если она
+        изменилась, чтобы не запрашивать её после каждого события.
+        """
+        room_id = event.game.room_id
+        version = self.touch(room_id)
+        if self.bus is None and not self.clients.get(room_id):
+            self._states.pop(room_id, None)
+            return
+
+        state = game_state(event.game)
+        prev = self._states.get(room_id)
+        self._states[room_id] = (version, state)
+
+        # Кадр собирается в формате `EventData` без создания схемы
+        frame = encode(
+            {
+                "event": event.event_type,
+                "player": player_state(event.player),
+                "data": event.data,
+                "version": version,
+                "game": state if prev is None else None,
+                "delta": None
+                if prev is None
+                else diff_game(prev[1], state, prev[0], version),
+            }
+        ).decode()
+        # Руки уходят после общего события, которое клиенты процесса
+        # получают сразу, а не через шину
+        self.send(room_id, frame)
+        self._send_hands(event.game, version)
+
+    def _send_hands(self, game: MauGame, version: int) -> None:
+        """Отправляет игрокам их руки, если те изменились.
+
+        Рука уходит только подключениям самого игрока и только из
+        процесса, в котором живёт игра.
+        """
+        connections = [
+            connection
+            for connection in self.clients.get(game.room_id, [])
+            if connection.user_id is not None
+        ]
+        if not connections:
+            return
+
+        players = {pl.user_id: pl for pl in game.pm.iter(game.pm._players)}
+        hands: dict[str, bytes] = {}
+        for connection in connections:
+            player = players.get(connection.user_id)
+            if player is None:
+                continue
+            hand = hands.get(player.user_id)
+            if hand is None:
+                hand = hands[player.user_id] = encode_hand(player)
+            self._send_hand(connection, hand, version)
+
+    def _send_hand(
+        self, connection: ClientConnection, hand: bytes, version: int
+    ) -> None:
+        if hand == connection.hand:
+            return
+        connection.hand = hand
+        self.reply(
+            connection,
+            (
+                b'{"event":"hand","version":%d,"hand":%b}' % (version, hand)
+            ).decode(),
         )
 
-        for connection in self.clients.get(event.game.room_id, []):
-            try:
-                self.event_loop.create_task(
-                    connection.send_text(event_data.model_dump_json())
-                )
-            except Exception as e:
-                logger.error(e)
+    def send_hand(self, connection: ClientConnection, game: MauGame) -> None:
+        """Отправляет игроку его текущую руку сразу после подключения."""
+        if connection.user_id is None:
+            return
+        player = next(
+            (
+                pl
+                for pl in game.pm.iter(game.pm._players)
+                if pl.user_id == connection.user_id
+            ),
+            None,
+        )
+        if player is not None:
+            self._send_hand(
+                connection, encode_hand(player), self.version(game.room_id)
+            )
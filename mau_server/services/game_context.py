@@ -1,13 +1,28 @@
 """Получает игровой контекст."""
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
+from mau.game.game import MauGame
+from starlette.datastructures import URL
 
-from mau_server.config import sm, stm
-from mau_server.models import Room, User
+from mau_server.config import (
+    config,
+    room_index,
+    shards,
+    sm,
+    snapshots,
+    stm,
+    turns,
+    views,
+)
+from mau_server.models import Room, RoomState, User
 from mau_server.schemes.game import GameContext
 
+# Сколько раз запрос может быть перенаправлен между процессами
+MAX_HOPS = 2
+
 
 async def game_context(
+    request: Request,
     user: User = Depends(stm.read_token),
 ) -> GameContext:
     """Получает игровой контекст пользователя.
@@ -18,17 +33,123 @@ async def game_context(
     Если игрок не находится в комнате, вернётся ошибка.
     Также включат информацию об игре внутри комнаты и пользователя
     как игрока.
+
+    Комната пользователя берётся из индекса активных комнат без
+    обращения к базе данных.
+    Если игра комнаты живёт в другом процессе сервера, запрос будет
+    перенаправлен туда.
+    Число перенаправлений считается в параметре `hop`, чтобы процессы
+    с расходящимся списком владельцев не гоняли запрос по кругу.
+    Браузеры не повторяют заголовок `Authorization` при переходе на
+    другой адрес, поэтому такие клиенты должны сами повторить запрос
+    по адресу из заголовка `Location`.
     """
-    room = (
-        await Room.filter(players=user)
-        .exclude(status="ended")
-        .get_or_none()
-        .prefetch_related("players")
-    )
+    if config.debug:
+        await room_index.verify(user)
+
+    room = await room_index.room(user)
     if room is None:
         raise HTTPException(404, "user not in room")
 
-    game = sm.room(str(room.id))
+    room_id = str(room.id)
+    owner = await shards.owner(room_id)
+    if owner != shards.worker_id:
+        owner_url = shards.worker_url(owner)
+        hop_param = request.query_params.get("hop", "0")
+        hop = int(hop_param) if hop_param.isdigit() else MAX_HOPS
+        if not owner_url or hop >= MAX_HOPS:
+            raise HTTPException(503, "Room worker is unavailable")
+        location = URL(owner_url)
+        redirect = request.url.replace(
+            scheme=location.scheme, netloc=location.netloc
+        ).include_query_params(hop=hop + 1)
+        raise HTTPException(
+            307,
+            "Room is served by another worker",
+            headers={"Location": str(redirect)},
+        )
+
+    return await room_context(user, room)
+
+
+async def load_game(room_id: str) -> MauGame | None:
+    """Получает игру комнаты, восстанавливая её из снимка при нужде.
+
+    Восстановленная игра закрепляется за текущим процессом и сразу
+    получает срок текущего хода, не дожидаясь следующего хода игроков.
+    Если комнату успел закрепить другой процесс, восстановленная игра
+    выгружается и вернётся ошибка 503.
+    """
+    game = sm.room(room_id)
+    if game is None:
+        game = await snapshots.restore(room_id)
+        if game is not None:
+            if not await shards.claim(room_id):
+                drop_session(room_id)
+                raise HTTPException(503, "Room is served by another worker")
+            turns.reschedule(room_id)
+    return game
+
+
+def drop_session(room_id: str) -> None:
+    """Выгружает игру комнаты из памяти процесса.
+
+    Снимок и закрепление комнаты остаются нетронутыми.
+    """
+    if sm.room(room_id) is not None:
+        sm.remove(room_id)
+    sm._event_handler.forget(room_id)
+    views.forget(room_id)
+    turns.cancel(room_id)
+    snapshots.untrack(room_id)
+
+
+async def close_session(room_id: str) -> None:
+    """Завершает игру комнаты насовсем.
+
+    Игра выгружается из памяти процесса, комната открепляется, а её
+    снимок удаляется, чтобы игру никто не восстановил.
+    """
+    drop_session(room_id)
+    await shards.release(room_id)
+    await snapshots.forget(room_id)
+
+
+async def serves(room_id: str) -> bool:
+    """Проверяет, что в комнате ещё идёт игра этого процесса.
+
+    Комната должна существовать, не быть завершённой и быть
+    закреплена за текущим процессом.
+    """
+    if await shards.owner(room_id) != shards.worker_id:
+        return False
+    return (
+        await Room.exclude(status=RoomState.ended).filter(id=room_id).exists()
+    )
+
+
+async def hand_off(room_id: str) -> None:
+    """Отдаёт игру комнаты, которую теперь обслуживает другой процесс.
+
+    Если комнату ещё никто не закрепил, игра сохраняется в последний
+    раз, и новый владелец восстановит её из этого снимка.
+    Если комнату уже закрепил другой процесс, он мог восстановить
+    игру раньше, и его снимок не перезаписывается.
+    """
+    if await shards.claimed_by(room_id) in (None, shards.worker_id):
+        await snapshots.checkpoint(force=True, rooms=[room_id])
+    drop_session(room_id)
+
+
+async def room_context(user: User, room: Room) -> GameContext:
+    """Собирает игровой контекст пользователя в известной комнате.
+
+    Игра комнаты должна жить в текущем процессе.
+    Если игры ещё нет в памяти после перезапуска, она восстановится
+    из снимка.
+    """
+    room_id = str(room.id)
+    game = await load_game(room_id)
     if game is not None:
         player = sm.player(user.username)
     else:
@@ -39,4 +160,5 @@ async def game_context(
         room=room,
         game=game,
         player=player,
+        version=sm._event_handler.version(room_id),
     )
@@ -0,0 +1,249 @@
+"""Таблица лидеров поверх Redis.
+
+Для каждой категории хранится отдельное сортированное множество, где
+пользователи упорядочены по значению своей статистики.
+Место пользователя, лучшие игроки и соседи по таблице получаются за
+логарифмическое время вместо сортировки всех пользователей.
+Множества обновляются вместе со статистикой пользователей и
+пересобираются из базы данных, если их ещё нет.
+"""
+
+import asyncio
+
+from redis.asyncio.client import Pipeline, Redis
+
+from mau_server.models import User
+from mau_server.schemes.leaderboard import CategoryEnum, LeaderboardEntry
+
+# Ставится только после полной пересборки таблиц из базы данных
+BUILT_KEY = "leaderboard:built"
+# Не даёт нескольким процессам пересобирать таблицы одновременно
+LOCK_KEY = "leaderboard:lock"
+# Сколько секунд может длиться пересборка таблиц
+LOCK_TTL = 300
+# Категории, где лучше меньшее значение
+ASCENDING = frozenset({CategoryEnum.cards_count})
+
+
+class Leaderboard:
+    """Хранит таблицы лидеров всех категорий.
+
+    Пока таблицы ни разу не собраны из базы данных, изменения
+    статистики в них не записываются: пересборка всё равно прочитает
+    их из базы данных.
+    Только изменения, записанные в базу данных во время самой первой
+    сборки, могут в неё не попасть.
+    Таблицы собирает первый процесс, который к ним обратился, а
+    остальные ждут окончания сборки.
+
+    Пользователи с одинаковым значением делят одно место, как если бы
+    место считалось по количеству пользователей с лучшим значением.
+    В категории карт лучше меньшее значение, и в неё попадают только
+    пользователи, сыгравшие хотя бы одну игру.
+
+    :param redis: Клиент Redis для хранения таблиц.
+    :type redis: Redis
+    :param chunk_size: Сколько пользователей загружать за раз при
+        пересборке таблиц.
+    :type chunk_size: int
+    """
+
+    def __init__(self, redis: Redis, chunk_size: int = 1000) -> None:
+        self._redis = redis
+        self._chunk_size = chunk_size
+        self._ready = False
+
+    @staticmethod
+    def key(category: CategoryEnum) -> str:
+        """Получает ключ таблицы категории."""
+        return f"leaderboard:{category.value}"
+
+    async def _built(self) -> bool:
+        """Проверяет, собраны ли уже таблицы."""
+        if not self._ready:
+            self._ready = bool(await self._redis.exists(BUILT_KEY))
+        return self._ready
+
+    async def update(self, user: User) -> None:
+        """Записывает всю статистику пользователя в таблицы."""
+        if not await self._built():
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for category in CategoryEnum:
+                if category in ASCENDING and not user.play_count:
+                    continue
+                pipe.zadd(
+                    self.key(category),
+                    {user.username: getattr(user, category.name)},
+                )
+            await pipe.execute()
+
+    async def incr(
+        self,
+        values: dict[str, dict[CategoryEnum, int]],
+        pipe: Pipeline | None = None,
+    ) -> None:
+        """Увеличивает статистику пользователей одним запросом.
+
+        :param values: Насколько увеличить каждую категорию для
+            каждого пользователя.
+        :type values: dict[str, dict[CategoryEnum, int]]
+        :param pipe: Добавить команды в уже открытую транзакцию вместо
+            отдельного запроса.
+        :type pipe: Pipeline | None
+        """
+        if not await self._built():
+            return
+        if pipe is not None:
+            for username, categories in values.items():
+                for category, amount in categories.items():
+                    pipe.zincrby(self.key(category), amount, username)
+            return
+        async with self._redis.pipeline(transaction=False) as new_pipe:
+            await self.incr(values, new_pipe)
+            await new_pipe.execute()
+
+    async def rename(self, old_username: str, user: User) -> None:
+        """Переносит пользователя в таблицах после смены имени."""
+        if not await self._built():
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for category in CategoryEnum:
+                pipe.zrem(self.key(category), old_username)
+            await pipe.execute()
+        await self.update(user)
+
+    async def rebuild(self) -> None:
+        """Пересобирает все таблицы из базы данных.
+
+        Пользователи загружаются порциями по имени пользователя.
+        Новые таблицы собираются во временных ключах и подменяют
+        старые разом, вместе с отметкой о сборке.
+        """
+        fields = [category.name for category in CategoryEnum]
+        await self._redis.delete(
+            *(f"{self.key(category)}:rebuild" for category in CategoryEnum)
+        )
+        last_username = ""
+        while True:
+            chunk = (
+                await User.filter(username__gt=last_username)
+                .order_by("username")
+                .limit(self._chunk_size)
+                .values_list("username", *fields)
+            )
+            if not chunk:
+                break
+
+            played = fields.index(CategoryEnum.play_count.name) + 1
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for i, category in enumerate(CategoryEnum, start=1):
+                    scores = {
+                        row[0]: row[i]
+                        for row in chunk
+                        if category not in ASCENDING or row[played]
+                    }
+                    if scores:
+                        pipe.zadd(f"{self.key(category)}:rebuild", scores)
+                await pipe.execute()
+            last_username = chunk[-1][0]
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for category in CategoryEnum:
+                pipe.exists(f"{self.key(category)}:rebuild")
+            built = await pipe.execute()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for category, exists in zip(CategoryEnum, built, strict=True):
+                pipe.delete(self.key(category))
+                if exists:
+                    pipe.rename(
+                        f"{self.key(category)}:rebuild", self.key(category)
+                    )
+            pipe.set(BUILT_KEY, 1)
+            await pipe.execute()
+        self._ready = True
+
+    async def _ensure(self) -> None:
+        """Собирает таблицы при первом обращении, если их ещё нет.
+
+        Если таблицы уже собирает другой процесс, ждёт окончания
+        сборки.
+        """
+        while not await self._built():
+            if await self._redis.set(LOCK_KEY, 1, nx=True, ex=LOCK_TTL):
+                try:
+                    await self.rebuild()
+                finally:
+                    await self._redis.delete(LOCK_KEY)
+                return
+            await asyncio.sleep(0.1)
+
+    async def top(self, category: CategoryEnum, limit: int) -> list[str]:
+        """Получает лучших пользователей категории."""
+        await self._ensure()
+        return [name for name, _ in await self._range(category, 0, limit - 1)]
+
+    async def _range(
+        self, category: CategoryEnum, start: int, end: int
+    ) -> list[tuple[str, float]]:
+        """Получает пользователей с `start` по `end` от лучшего."""
+        if category in ASCENDING:
+            return await self._redis.zrange(
+                self.key(category), start, end, withscores=True
+            )
+        return await self._redis.zrevrange(
+            self.key(category), start, end, withscores=True
+        )
+
+    async def _position(self, category: CategoryEnum, score: float) -> int:
+        """Получает место значения: сколько значений лучше него, плюс 1."""
+        if category in ASCENDING:
+            better = await self._redis.zcount(
+                self.key(category), "-inf", f"({score}"
+            )
+        else:
+            better = await self._redis.zcount(
+                self.key(category), f"({score}", "+inf"
+            )
+        return better + 1
+
+    async def rank(self, category: CategoryEnum, username: str) -> int | None:
+        """Получает место пользователя в категории, начиная с 1."""
+        await self._ensure()
+        score = await self._redis.zscore(self.key(category), username)
+        if score is None:
+            return None
+        return await self._position(category, score)
+
+    async def around(
+        self, category: CategoryEnum, username: str, radius: int
+    ) -> list[LeaderboardEntry] | None:
+        """Получает соседей пользователя по таблице.
+
+        Включает самого пользователя и до `radius` пользователей выше
+        и ниже него.
+        """
+        await self._ensure()
+        if category in ASCENDING:
+            index = await self._redis.zrank(self.key(category), username)
+        else:
+            index = await self._redis.zrevrank(self.key(category), username)
+        if index is None:
+            return None
+
+        start = max(index - radius, 0)
+        entries = await self._range(category, start, index + radius)
+        res: list[LeaderboardEntry] = []
+        for i, (name, score) in enumerate(entries):
+            if not res:
+                position = await self._position(category, score)
+            elif score == res[-1].value:
+                position = res[-1].position
+            else:
+                position = start + i + 1
+            res.append(
+                LeaderboardEntry(
+                    username=name, position=position, value=int(score)
+                )
+            )
+        return res
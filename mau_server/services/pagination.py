@@ -0,0 +1,45 @@
+"""Постраничная выдача списков.
+
+Вместо смещения используется курсор: значения ключа сортировки
+последней записи страницы.
+Следующая страница начинается строго после этой записи, поэтому
+база данных не перебирает пропущенные записи, а новые записи не
+сдвигают страницы.
+"""
+
+import base64
+import json
+from typing import Any
+
+from fastapi import HTTPException
+from tortoise.expressions import Q
+
+
+def encode_cursor(*values: Any) -> str:  # noqa: ANN401
+    """Запаковывает ключ последней записи страницы в курсор."""
+    return base64.urlsafe_b64encode(
+        json.dumps(values, default=str).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list[Any]:
+    """Распаковывает курсор обратно в ключ записи.
+
+    Если курсор повреждён, вернёт ошибку 400.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor))
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(400, "Invalid cursor")
+    return values
+
+
+def after(field: str, value: Any, pk: Any, descending: bool) -> Q:  # noqa: ANN401
+    """Условие для записей, идущих после ключа в порядке сортировки.
+
+    Записи упорядочены по полю, а при равенстве по первичному ключу.
+    """
+    op = "lt" if descending else "gt"
+    return Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk})
@@ -0,0 +1,97 @@
+"""Хеширование паролей пользователей.
+
+Bcrypt специально работает медленно, одна проверка пароля занимает
+десятки миллисекунд.
+Чтобы не останавливать на это время весь цикл событий сервера,
+хеширование выполняется в отдельном пуле потоков ограниченного размера.
+"""
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+import bcrypt
+from fastapi import HTTPException
+
+_T = TypeVar("_T")
+
+
+class PasswordHasher:
+    """Хеширует и проверяет пароли в отдельных потоках.
+
+    Одновременно выполняется не больше `workers` операций.
+    Остальные ждут своей очереди, а если очередь переполнена,
+    запрос сразу получит ошибку вместо бесконечного ожидания.
+
+    :param rounds: Сложность хеширования bcrypt.
+    :type rounds: int
+    :param workers: Сколько паролей можно хешировать одновременно.
+    :type workers: int
+    :param max_pending: Сколько операций может ждать в очереди.
+    :type max_pending: int
+    """
+
+    def __init__(
+        self, rounds: int = 12, workers: int = 2, max_pending: int = 64
+    ) -> None:
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+        self._slots = asyncio.Semaphore(workers)
+        self._max_pending = max_pending
+        self.pending = 0
+
+    async def _run(self, func: Callable[..., _T], *args: object) -> _T:
+        if self.pending >= self._max_pending:
+            raise HTTPException(503, "Too many password operations")
+
+        self.pending += 1
+        try:
+            async with self._slots:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._executor, func, *args
+                )
+        finally:
+            self.pending -= 1
+
+    def _hash(self, password: str) -> str:
+        return str(
+            bcrypt.hashpw(
+                bytes(password, "utf-8"), bcrypt.gensalt(rounds=self.rounds)
+            ),
+            "utf-8",
+        )
+
+    @staticmethod
+    def _verify(password: str, password_hash: str) -> bool:
+        return bcrypt.checkpw(
+            bytes(password, "utf-8"), bytes(password_hash, "utf-8")
+        )
+
+    async def hash(self, password: str) -> str:
+        """Получает хеш пароля с текущей сложностью."""
+        return await self._run(self._hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        """Проверяет, что пароль соответствует хешу."""
+        return await self._run(self._verify, password, password_hash)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Проверяет, посчитан ли хеш с другой сложностью.
+
+        Такие хеши стоит пересчитать при следующем входе пользователя.
+        """
+        try:
+            return int(password_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self) -> None:
+        """Останавливает пул потоков."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, int]:
+        """Получает количество ожидающих операций."""
+        return {"rounds": self.rounds, "pending": self.pending}
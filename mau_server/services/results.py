@@ -0,0 +1,420 @@
+"""Фоновое сохранение итогов игр.
+
+Последний ход игры не должен ждать записи в базу данных.
+Итоги завершённых игр складываются в очередь, а фоновая задача
+записывает их пачками, каждую пачку в одной транзакции.
+Очередь хранится в списке Redis, поэтому переживает перезапуск сервера.
+Одну очередь могут разбирать сразу несколько процессов сервера.
+"""
+
+import asyncio
+import time
+from collections.abc import Callable, Iterable
+from uuid import UUID, uuid4
+
+from loguru import logger
+from pydantic import ValidationError
+from redis.asyncio.client import Redis
+from tortoise.expressions import Case, F, When
+from tortoise.transactions import in_transaction
+
+from mau_server.models import Game, Room, User
+from mau_server.schemes.game import GameResult
+from mau_server.schemes.leaderboard import CategoryEnum
+from mau_server.services.leaderboard import Leaderboard
+
+# Наибольшая задержка повтора записи итогов (в секундах)
+MAX_RETRY_DELAY = 30.0
+# Сколько раз пробовать записать одну игру
+MAX_ATTEMPTS = 5
+# Итоги, которые так и не удалось записать
+DEAD_KEY = "games:dead"
+# Сколько раз не удалось записать каждую игру
+ATTEMPTS_KEY = "games:attempts"
+# Списки итогов, которые сейчас записывает каждый процесс
+PROCESSING_PREFIX = "games:processing"
+# Отметки живых процессов, записывающих итоги
+WRITER_PREFIX = "games:writer"
+# Сколько живёт отметка процесса без обновления (в секундах)
+WRITER_TTL = 120
+# Как часто искать итоги пропавших процессов (в секундах)
+RECOVER_INTERVAL = 60.0
+
+
+def _count(
+    stats: dict[str, dict[CategoryEnum, int]],
+    res: GameResult,
+    users: dict[str, User],
+) -> None:
+    """Добавляет итоги игры к приращениям статистики участников."""
+    for username, amount in res.cards.items():
+        if username not in users:
+            logger.error("Not found player {}", username)
+            continue
+        user_stats = stats.setdefault(
+            username,
+            {
+                CategoryEnum.play_count: 0,
+                CategoryEnum.win_count: 0,
+                CategoryEnum.cards_count: 0,
+            },
+        )
+        user_stats[CategoryEnum.play_count] += 1
+        user_stats[CategoryEnum.cards_count] += amount
+        if username in res.winners:
+            user_stats[CategoryEnum.win_count] += 1
+
+
+def _increment(
+    stats: dict[str, dict[CategoryEnum, int]], category: CategoryEnum
+) -> Case:
+    """Выбирает приращение статистики участника по его имени."""
+    return Case(
+        *(
+            When(username=username, then=user_stats[category])
+            for username, user_stats in stats.items()
+        ),
+        default=0,
+    )
+
+
+async def save_results(
+    results: list[GameResult],
+) -> tuple[dict[str, dict[CategoryEnum, int]], list[GameResult]]:
+    """Записывает итоги нескольких игр в одной транзакции.
+
+    Все участники всех игр загружаются одним запросом.
+    Каждая игра записывается в своей точке сохранения, поэтому ошибка
+    в одной игре не отменяет запись остальных.
+    Статистика всех участников увеличивается прямо в базе данных
+    одним запросом, приращение каждого выбирается по имени.
+    Уже записанные игры пропускаются, поэтому пачку можно безопасно
+    записать повторно.
+
+    Статистика участников:
+    - play_count: Каждому участнику.
+    - win_count: Каждому победителю.
+    - cards_count: Сколько карт осталось на руках в конце игры.
+      Чем меньше, тем выше игрок в таблице лидеров.
+
+    Вернёт приращения статистики по всем записанным играм пачки,
+    включая записанные раньше, и игры, которые записать не удалось.
+    """
+    failed: list[GameResult] = []
+    async with in_transaction("models"):
+        saved = set(
+            await Game.filter(id__in=[res.id for res in results]).values_list(
+                "id", flat=True
+            )
+        )
+        rooms = set(
+            await Room.filter(
+                id__in=[res.room_id for res in results]
+            ).values_list("id", flat=True)
+        )
+        max_length = User._meta.fields_map["username"].max_length
+        usernames = {
+            name
+            for res in results
+            for name in (*res.cards, res.owner)
+            if len(name) <= max_length
+        }
+        users = {
+            user.username: user
+            for user in await User.filter(username__in=usernames)
+        }
+
+        stats: dict[str, dict[CategoryEnum, int]] = {}
+        new_stats: dict[str, dict[CategoryEnum, int]] = {}
+        for res in results:
+            if res.room_id not in rooms:
+                logger.error("Not found room {} for game", res.room_id)
+                continue
+            if res.id not in saved:
+                try:
+                    async with in_transaction("models"):
+                        await _save_game(res, users)
+                except Exception as e:
+                    logger.error("Failed to save game {}: {}", res.id, e)
+                    failed.append(res)
+                    continue
+                _count(new_stats, res, users)
+            _count(stats, res, users)
+
+        if new_stats:
+            await User.filter(username__in=list(new_stats)).update(
+                **{
+                    category.name: F(category.name)
+                    + _increment(new_stats, category)
+                    for category in (
+                        CategoryEnum.play_count,
+                        CategoryEnum.win_count,
+                        CategoryEnum.cards_count,
+                    )
+                }
+            )
+    return stats, failed
+
+
+async def _save_game(res: GameResult, users: dict[str, User]) -> None:
+    """Записывает одну игру вместе с победителями и проигравшими."""
+    owner = users.get(res.owner)
+    if owner is None:
+        raise ValueError(f"Not found game owner {res.owner}")
+    game = await Game.create(
+        id=res.id,
+        create_time=res.game_started,
+        end_time=res.game_ended,
+        owner=owner,
+        room_id=res.room_id,
+    )
+    win_users = [users[name] for name in res.winners if name in users]
+    if win_users:
+        await game.winners.add(*win_users)
+    lose_users = [users[name] for name in res.losers if name in users]
+    if lose_users:
+        await game.losers.add(*lose_users)
+
+
+class ResultWriter:
+    """Записывает итоги игр в базу данных в фоне.
+
+    Итоги попадают в общий список Redis и сразу будят фоновую задачу.
+    Задача атомарно переносит пачку итогов из общего списка в свой
+    список обработки, поэтому несколько процессов никогда не получат
+    одни и те же итоги.
+    Пачка убирается из списка обработки в одной транзакции Redis с
+    обновлением таблицы лидеров, так что при падении процесса пачка
+    будет записана заново, а уже записанные игры пропущены.
+
+    Игры, которые не удалось записать, возвращаются в конец очереди.
+    После `MAX_ATTEMPTS` неудачных попыток итоги переносятся в список
+    `games:dead` для ручного разбора и больше не мешают остальным.
+    При ошибке всей пачки запись повторяется с нарастающей задержкой.
+    При остановке сервера очередь записывается до конца.
+    После записи пачки вызывается `on_saved` с именами участников,
+    чья статистика изменилась, например чтобы сбросить их из кеша.
+
+    Списки обработки пропавших процессов возвращаются в общую очередь
+    при запуске и периодически во время работы.
+
+    :param redis: Клиент Redis, где хранится очередь.
+    :type redis: Redis
+    :param leaderboard: Таблица лидеров для обновления статистики.
+    :type leaderboard: Leaderboard
+    :param key: Ключ списка с очередью итогов.
+    :type key: str
+    :param batch_size: Сколько игр записывать за одну транзакцию.
+    :type batch_size: int
+    :param flush_interval: Как часто проверять очередь. (в секундах)
+    :type flush_interval: float
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        leaderboard: Leaderboard,
+        key: str = "games:pending",
+        batch_size: int = 50,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self._redis = redis
+        self._leaderboard = leaderboard
+        self._key = key
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._id = uuid4().hex
+        self._processing = f"{PROCESSING_PREFIX}:{self._id}"
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task[None] | None = None
+        self.on_saved: Callable[[Iterable[str]], None] | None = None
+
+        self.depth = 0
+        self.flushed = 0
+        self.failures = 0
+        self.dead = 0
+        self.last_flush = 0.0
+        self.flush_time = 0.0
+        self.flush_count = 0
+
+    async def submit(self, result: GameResult) -> None:
+        """Ставит итоги игры в очередь на запись."""
+        await self._redis.rpush(self._key, result.model_dump_json())
+        self.depth += 1
+        self._wakeup.set()
+
+    async def _take(self) -> list[str]:
+        """Получает пачку итогов для записи.
+
+        Если в списке обработки остались итоги после ошибки, сначала
+        записываются они.
+        """
+        items = await self._redis.lrange(self._processing, 0, -1)
+        if items:
+            return items
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for _ in range(self._batch_size):
+                pipe.lmove(self._key, self._processing, "LEFT", "RIGHT")
+            pipe.llen(self._key)
+            *moved, self.depth = await pipe.execute()
+        return [item for item in moved if item is not None]
+
+    async def flush(self) -> int:
+        """Записывает одну пачку итогов из начала очереди.
+
+        Вернёт количество итогов, которые больше не нужно повторять.
+        """
+        async with self._lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        items = await self._take()
+        if not items:
+            return 0
+
+        start = time.perf_counter()
+        results: dict[UUID, tuple[GameResult, str]] = {}
+        dead: list[str] = []
+        for item in items:
+            try:
+                res = GameResult.model_validate_json(item)
+            except ValidationError as e:
+                logger.error("Drop invalid game result: {}", e)
+                dead.append(item)
+                continue
+            results[res.id] = (res, item)
+
+        stats, failed = await save_results([res for res, _ in results.values()])
+
+        retry: dict[UUID, str] = {}
+        if failed:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for res in failed:
+                    pipe.hincrby(ATTEMPTS_KEY, str(res.id), 1)
+                attempts = await pipe.execute()
+            for res, attempt in zip(failed, attempts, strict=True):
+                if attempt >= MAX_ATTEMPTS:
+                    logger.error("Move game {} to {}", res.id, DEAD_KEY)
+                    dead.append(results[res.id][1])
+                else:
+                    retry[res.id] = results[res.id][1]
+
+        done = [str(res_id) for res_id in results if res_id not in retry]
+        async with self._redis.pipeline(transaction=True) as pipe:
+            await self._leaderboard.incr(stats, pipe)
+            if retry:
+                pipe.rpush(self._key, *retry.values())
+            if dead:
+                pipe.rpush(DEAD_KEY, *dead)
+            if done:
+                pipe.hdel(ATTEMPTS_KEY, *done)
+            pipe.delete(self._processing)
+            await pipe.execute()
+        if stats and self.on_saved is not None:
+            self.on_saved(stats)
+
+        self.last_flush = time.perf_counter() - start
+        self.flush_time += self.last_flush
+        self.flush_count += 1
+        self.flushed += len(results) - len(failed)
+        self.dead += len(dead)
+        return len(items) - len(retry)
+
+    async def drain(self) -> None:
+        """Записывает итоги, пока очередь не опустеет.
+
+        Останавливается раньше, если в пачке остались только игры для
+        повтора, чтобы не повторять их без задержки.
+        """
+        while await self.flush():
+            pass
+
+    async def _alive(self) -> None:
+        """Отмечает, что процесс жив и его список обработки занят."""
+        await self._redis.set(f"{WRITER_PREFIX}:{self._id}", 1, ex=WRITER_TTL)
+
+    async def _move_back(self, key: str) -> int:
+        """Переносит все итоги из списка в общую очередь."""
+        moved = 0
+        while await self._redis.lmove(key, self._key, "LEFT", "RIGHT"):
+            moved += 1
+        return moved
+
+    async def recover(self) -> None:
+        """Возвращает в очередь итоги пропавших процессов.
+
+        Забирает списки обработки процессов, которые давно не
+        отмечались, и очереди отдельных процессов из прошлых версий
+        сервера.
+        """
+        async for key in self._redis.scan_iter(match=f"{PROCESSING_PREFIX}:*"):
+            writer = key.rsplit(":", 1)[1]
+            if writer == self._id or await self._redis.exists(
+                f"{WRITER_PREFIX}:{writer}"
+            ):
+                continue
+            if moved := await self._move_back(key):
+                logger.warning("Recover {} game results from {}", moved, key)
+        async for key in self._redis.scan_iter(match=f"{self._key}:*"):
+            if moved := await self._move_back(key):
+                logger.warning("Recover {} game results from {}", moved, key)
+
+    async def start(self) -> None:
+        """Запускает фоновую запись итогов."""
+        await self._alive()
+        await self.recover()
+        self.depth = await self._redis.llen(self._key)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и дописывает очередь."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.drain()
+            await self._redis.delete(f"{WRITER_PREFIX}:{self._id}")
+        except Exception as e:
+            logger.error("Failed to drain game results: {}", e)
+
+    async def _run(self) -> None:
+        retry_delay = self._flush_interval
+        last_recover = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self._flush_interval
+                )
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self._alive()
+                if time.monotonic() - last_recover > RECOVER_INTERVAL:
+                    last_recover = time.monotonic()
+                    await self.recover()
+                await self.drain()
+            except Exception as e:
+                self.failures += 1
+                logger.error("Failed to save game results: {}", e)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+            else:
+                retry_delay = self._flush_interval
+
+    def stats(self) -> dict[str, float]:
+        """Получает глубину очереди и время записи пачек."""
+        return {
+            "depth": self.depth,
+            "flushed": self.flushed,
+            "failures": self.failures,
+            "dead": self.dead,
+            "last_flush_ms": self.last_flush * 1000,
+            "avg_flush_ms": self.flush_time / self.flush_count * 1000
+            if self.flush_count
+            else 0,
+        }
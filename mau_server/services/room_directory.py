@@ -0,0 +1,285 @@
+"""Каталог открытых комнат.
+
+Клиенты в лобби больше не опрашивают список комнат.
+Каталог хранит краткую информацию обо всех открытых комнатах в памяти,
+а подписанные через веб сокет клиенты получают весь каталог один раз и
+затем только изменения отдельных комнат.
+Маршруты управления комнатами обновляют каталог после каждого
+изменения комнаты.
+При работе в нескольких процессах изменения каталога передаются через
+шину событий, так что каталог каждого процесса содержит комнаты всех
+процессов.
+
+Отдельно каталог хранит комнаты со свободными местами, сгруппированные
+по стоимости входа, чтобы выбирать случайную комнату для входа без
+перебора всех комнат.
+Количество комнат каждой стоимости хранится в дереве Фенвика, поэтому
+выбор занимает логарифмическое время от количества разных стоимостей.
+"""
+
+import random
+from bisect import bisect, insort
+from uuid import UUID, uuid4
+
+from fastapi import WebSocket
+from loguru import logger
+from pydantic import ValidationError
+from tortoise.functions import Count
+
+from mau_server.models import Room, RoomState
+from mau_server.schemes.roomlist import LobbyEvent, LobbyEventType, RoomEntry
+from mau_server.services.bus import RedisEventBus
+from mau_server.services.events import WebSocketEventHandler
+
+# Под этим ключом подписчики каталога хранятся в обработчике событий
+LOBBY = "lobby"
+# Канал шины, куда процессы сообщают об изменениях каталога
+DIRECTORY_CHANNEL = "rooms:directory"
+
+
+class _CountTree:
+    """Дерево Фенвика над количествами комнат каждой стоимости входа.
+
+    Позволяет за логарифмическое время изменить количество и найти,
+    на какую стоимость приходится комната с заданным номером.
+    """
+
+    def __init__(self, counts: list[int]) -> None:
+        self._tree = [0, *counts]
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def add(self, index: int, amount: int) -> None:
+        """Изменяет количество комнат стоимости под номером `index`."""
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += amount
+            i += i & -i
+
+    def prefix(self, end: int) -> int:
+        """Получает количество комнат первых `end` стоимостей."""
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+    def find(self, rank: int) -> tuple[int, int]:
+        """Находит стоимость комнаты с номером `rank`.
+
+        Вернёт номер стоимости и номер комнаты среди комнат этой
+        стоимости.
+        """
+        pos = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= rank:
+                pos = nxt
+                rank -= self._tree[nxt]
+            step >>= 1
+        return pos, rank
+
+
+class RoomDirectory:
+    """Хранит открытые комнаты и рассылает их изменения.
+
+    Подписчики каталога обслуживаются тем же обработчиком событий,
+    что и игровые комнаты, с теми же ограниченными очередями.
+
+    Если указана шина событий, каждое изменение каталога сообщается
+    остальным процессам.
+    Они применяют его к своему каталогу и рассылают своим
+    подписчикам, поэтому весь каталог, отправляемый при подключении,
+    совпадает во всех процессах.
+
+    :param handler: Обработчик событий для рассылки изменений.
+    :type handler: WebSocketEventHandler
+    :param bus: Шина событий для обмена изменениями каталога.
+    :type bus: RedisEventBus | None
+    """
+
+    def __init__(
+        self, handler: WebSocketEventHandler, bus: RedisEventBus | None = None
+    ) -> None:
+        self._handler = handler
+        self._bus = bus
+        self._instance = uuid4().hex
+        if bus is not None:
+            bus.listen(DIRECTORY_CHANNEL, self._receive)
+        self._rooms: dict[UUID, RoomEntry] = {}
+        # Комнаты со свободными местами по стоимости входа
+        self._joinable: dict[int, list[UUID]] = {}
+        # Все встречавшиеся стоимости входа по возрастанию
+        self._prices: list[int] = []
+        self._counts = _CountTree([])
+        self._slots: dict[UUID, tuple[int, int]] = {}
+
+    def rooms(self) -> list[RoomEntry]:
+        """Получает все открытые комнаты."""
+        return list(self._rooms.values())
+
+    async def load(self) -> None:
+        """Загружает открытые комнаты из базы данных."""
+        rooms = (
+            await Room.filter(
+                private=False, status__in=(RoomState.idle, RoomState.game)
+            )
+            .annotate(players_count=Count("players"))
+            .prefetch_related("owner")
+        )
+        self._rooms = {}
+        self._joinable = {}
+        self._prices = []
+        self._counts = _CountTree([])
+        self._slots = {}
+        for room in rooms:
+            entry = self._entry(room, room.players_count)
+            self._rooms[room.id] = entry
+            self._index(entry)
+
+    @staticmethod
+    def _entry(room: Room, players: int) -> RoomEntry:
+        return RoomEntry(
+            id=room.id,
+            name=room.name,
+            owner=room.owner.username,
+            players=players,
+            min_players=room.min_players,
+            max_players=room.max_players,
+            gems=room.gems,
+            status=room.status,
+        )
+
+    def _index(self, entry: RoomEntry) -> None:
+        """Обновляет комнату в наборе комнат для случайного входа."""
+        slot = self._slots.get(entry.id)
+        joinable = entry.players < entry.max_players
+        if slot is not None and (not joinable or slot[0] != entry.gems):
+            self._unindex(entry.id)
+            slot = None
+        if slot is not None or not joinable:
+            return
+
+        bucket = self._joinable.get(entry.gems)
+        if bucket is None:
+            bucket = self._joinable[entry.gems] = []
+            insort(self._prices, entry.gems)
+            # Новая стоимость сдвигает номера, дерево собирается заново
+            self._counts = _CountTree(
+                [len(self._joinable[price]) for price in self._prices]
+            )
+        self._slots[entry.id] = (entry.gems, len(bucket))
+        bucket.append(entry.id)
+        self._counts.add(self._price_index(entry.gems), 1)
+
+    def _price_index(self, gems: int) -> int:
+        return bisect(self._prices, gems) - 1
+
+    def _unindex(self, room_id: UUID) -> None:
+        """Убирает комнату из набора, переставляя последнюю на её место.
+
+        Стоимость остаётся в дереве даже без комнат, чтобы не
+        пересобирать его при каждом опустевшем наборе.
+        """
+        slot = self._slots.pop(room_id, None)
+        if slot is None:
+            return
+        gems, index = slot
+        bucket = self._joinable[gems]
+        last_id = bucket.pop()
+        if last_id != room_id:
+            bucket[index] = last_id
+            self._slots[last_id] = (gems, index)
+        self._counts.add(self._price_index(gems), -1)
+
+    def random(self, gems: int) -> UUID | None:
+        """Выбирает случайную комнату со свободными местами.
+
+        Каждая комната, вход в которую стоит не больше `gems`,
+        выбирается с равной вероятностью.
+        Время выбора логарифмически зависит от количества разных
+        стоимостей входа и не зависит от количества комнат.
+        """
+        total = self._counts.prefix(bisect(self._prices, gems))
+        if total == 0:
+            return None
+        price, index = self._counts.find(random.randrange(total))
+        return self._joinable[self._prices[price]][index]
+
+    def _send(self, event: LobbyEvent) -> None:
+        frame = event.model_dump_json()
+        self._handler.broadcast(LOBBY, frame)
+        if self._bus is not None:
+            self._bus.notify(DIRECTORY_CHANNEL, f"{self._instance}:{frame}")
+
+    def _receive(self, message: str) -> None:
+        """Применяет изменение каталога из другого процесса."""
+        instance, _, frame = message.partition(":")
+        if instance == self._instance:
+            return
+        try:
+            event = LobbyEvent.model_validate_json(frame)
+        except ValidationError as e:
+            logger.error("Invalid directory event: {}", e)
+            return
+
+        if event.event == LobbyEventType.remove and event.room_id is not None:
+            self._unindex(event.room_id)
+            self._rooms.pop(event.room_id, None)
+        else:
+            for entry in event.rooms:
+                self._rooms[entry.id] = entry
+                self._index(entry)
+        self._handler.broadcast(LOBBY, frame)
+
+    def put(self, room: Room) -> None:
+        """Добавляет или обновляет комнату в каталоге.
+
+        Комната должна быть загружена вместе с игроками и владельцем.
+        Закрытые и завершённые комнаты из каталога убираются.
+        """
+        if room.private or room.status == RoomState.ended:
+            self.remove(room.id)
+            return
+
+        entry = self._entry(room, len(room.players))
+        old_entry = self._rooms.get(room.id)
+        if old_entry == entry:
+            return
+
+        self._rooms[room.id] = entry
+        self._index(entry)
+        self._send(
+            LobbyEvent(
+                event=LobbyEventType.add
+                if old_entry is None
+                else LobbyEventType.update,
+                rooms=[entry],
+            )
+        )
+
+    def remove(self, room_id: UUID) -> None:
+        """Убирает комнату из каталога."""
+        self._unindex(room_id)
+        if self._rooms.pop(room_id, None) is not None:
+            self._send(LobbyEvent(event=LobbyEventType.remove, room_id=room_id))
+
+    def _snapshot(self) -> str:
+        return LobbyEvent(
+            event=LobbyEventType.snapshot, rooms=self.rooms()
+        ).model_dump_json()
+
+    async def connect(self, websocket: WebSocket) -> None:
+        """Подписывает клиента на каталог и отправляет весь каталог.
+
+        Весь каталог встаёт в очередь клиента первым, в тот же момент,
+        когда клиент начинает получать изменения.
+        """
+        await self._handler.connect(LOBBY, websocket, greeting=self._snapshot)
+
+    def disconnect(self, websocket: WebSocket) -> None:
+        """Отписывает клиента от каталога."""
+        self._handler.disconnect(LOBBY, websocket)
@@ -0,0 +1,143 @@
+"""Индекс активных комнат пользователей.
+
+Игровой контекст нужен каждому игровому запросу.
+Чтобы не искать комнату пользователя в базе данных на каждый ход,
+активные комнаты вместе с игроками и владельцем хранятся в памяти.
+Маршруты управления комнатами обновляют индекс после каждого
+изменения комнаты.
+"""
+
+from uuid import UUID, uuid4
+
+from loguru import logger
+
+from mau_server.models import Room, RoomState, User
+from mau_server.services.bus import RedisEventBus
+
+# Канал шины, куда сообщается об изменении комнат
+ROOMS_CHANNEL = "rooms:changed"
+
+
+class RoomIndex:
+    """Хранит активную комнату каждого пользователя.
+
+    Если пользователя нет в индексе, комната ищется в базе данных и
+    попадает в индекс.
+    Индекс живёт внутри процесса.
+    Если указана шина событий, процесс сообщает об изменённых
+    комнатах остальным, и те убирают комнату из своего индекса до
+    следующего обращения к базе данных.
+    Без шины изменения комнат через другие процессы индекс не видит.
+
+    :param bus: Шина событий для обмена изменёнными комнатами.
+    :type bus: RedisEventBus | None
+    """
+
+    def __init__(self, bus: RedisEventBus | None = None) -> None:
+        self._rooms: dict[UUID, Room] = {}
+        self._users: dict[UUID, UUID] = {}
+        self._bus = bus
+        self._instance = uuid4().hex
+        if bus is not None:
+            bus.listen(ROOMS_CHANNEL, self._forget)
+
+    def _forget(self, message: str) -> None:
+        """Убирает комнату, изменённую другим процессом."""
+        instance, _, room_id = message.partition(":")
+        if instance != self._instance:
+            self.drop(UUID(room_id))
+
+    def get(self, room_id: UUID) -> Room | None:
+        """Получает активную комнату по её ID."""
+        return self._rooms.get(room_id)
+
+    async def room(self, user: User) -> Room | None:
+        """Получает активную комнату пользователя."""
+        room_id = self._users.get(user.id)
+        if room_id is not None:
+            return self._rooms[room_id]
+
+        room = (
+            await Room.filter(players=user)
+            .exclude(status=RoomState.ended)
+            .get_or_none()
+            .prefetch_related("players", "owner")
+        )
+        if room is not None:
+            self.put(room)
+        return room
+
+    def put(self, room: Room) -> None:
+        """Добавляет или обновляет комнату в индексе.
+
+        Комната должна быть загружена вместе с игроками и владельцем.
+        """
+        self.drop(room.id)
+        if room.status == RoomState.ended:
+            return
+
+        self._rooms[room.id] = room
+        for player in room.players:
+            self._users[player.id] = room.id
+
+    def drop(self, room_id: UUID) -> None:
+        """Убирает комнату и её игроков из индекса."""
+        room = self._rooms.pop(room_id, None)
+        if room is None:
+            return
+        for player in room.players:
+            if self._users.get(player.id) == room_id:
+                self._users.pop(player.id)
+
+    def remove(self, room_id: UUID) -> None:
+        """Убирает удалённую комнату из индексов всех процессов."""
+        self._notify(room_id)
+        self.drop(room_id)
+
+    def _notify(self, room_id: UUID) -> None:
+        """Сообщает остальным процессам об изменении комнаты."""
+        if self._bus is not None:
+            self._bus.notify(ROOMS_CHANNEL, f"{self._instance}:{room_id}")
+
+    async def refresh(self, room_id: UUID) -> Room | None:
+        """Загружает актуальное состояние комнаты из базы данных.
+
+        Вызывается после каждого изменения комнаты.
+        Вернёт комнату, если она ещё активна.
+        """
+        self._notify(room_id)
+        room = await Room.get_or_none(id=room_id).prefetch_related(
+            "players", "owner"
+        )
+        if room is None:
+            self.drop(room_id)
+            return None
+        self.put(room)
+        return self._rooms.get(room_id)
+
+    async def verify(self, user: User) -> None:
+        """Сверяет индекс с базой данных.
+
+        Используется только в отладочном режиме.
+        При расхождении индекс исправляется.
+        """
+        db_room = (
+            await Room.filter(players=user)
+            .exclude(status=RoomState.ended)
+            .get_or_none()
+        )
+        db_room_id = None if db_room is None else db_room.id
+        if self._users.get(user.id) == db_room_id:
+            return
+
+        logger.error(
+            "Room index mismatch for {}: index {}, database {}",
+            user.username,
+            self._users.get(user.id),
+            db_room_id,
+        )
+        old_room_id = self._users.pop(user.id, None)
+        if old_room_id is not None:
+            await self.refresh(old_room_id)
+        if db_room_id is not None:
+            await self.refresh(db_room_id)
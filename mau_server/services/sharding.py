@@ -0,0 +1,343 @@
+"""Распределение игровых комнат между процессами сервера.
+
+Все игры комнаты живут в памяти одного процесса.
+Чтобы использовать сразу несколько процессов, каждая комната
+закрепляется ровно за одним из них.
+Владелец комнаты выбирается при помощи консистентного хеширования ID
+комнаты, поэтому при появлении или пропаже процесса переезжает лишь
+малая часть комнат.
+
+Список живых процессов хранится в Redis и обновляется каждым
+процессом периодически.
+
+Процесс закрепляет за собой каждую комнату, игру которой создал или
+восстановил из снимка.
+Если комната перешла к другому процессу, прежний владелец сохраняет
+игру в последний раз и выгружает её из памяти, чтобы две копии одной
+игры не жили одновременно.
+
+Запросы к чужой комнате перенаправляются прямо на нужный процесс,
+поэтому у каждого процесса должен быть свой постоянный ID и адрес.
+Несколько процессов uvicorn за одним портом так не различить, каждому
+процессу нужен собственный порт и свои `WORKER_ID` и `WORKER_URL`.
+"""
+
+import asyncio
+import time
+from bisect import bisect
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from hashlib import blake2b
+from uuid import UUID, uuid4
+
+from loguru import logger
+from redis.asyncio.client import Redis
+from redis.exceptions import WatchError
+
+from mau_server.services.bus import RedisEventBus
+
+WORKERS_KEY = "shard:workers"
+URLS_KEY = "shard:urls"
+CLAIMS_KEY = "shard:claims"
+# Канал шины, куда сообщается о закреплении и откреплении комнат
+CLAIMS_CHANNEL = "shard:claims"
+# Как часто процесс сообщает что он жив (в секундах)
+HEARTBEAT = 5.0
+# Сколько закреплений комнат хранить в памяти процесса
+CLAIMS_CACHE_SIZE = 10_000
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest())
+
+
+class HashRing:
+    """Кольцо консистентного хеширования.
+
+    Каждый процесс занимает на кольце несколько виртуальных точек,
+    чтобы комнаты распределялись между процессами равномерно.
+
+    :param nodes: Начальный список процессов.
+    :type nodes: Iterable[str]
+    :param replicas: Сколько виртуальных точек у каждого процесса.
+    :type replicas: int
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64) -> None:
+        self._replicas = replicas
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        self.nodes: frozenset[str] = frozenset()
+        self.rebuild(nodes)
+
+    def rebuild(self, nodes: Iterable[str]) -> None:
+        """Пересобирает кольцо для нового списка процессов."""
+        self.nodes = frozenset(nodes)
+        ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(self._replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def get(self, key: str) -> str | None:
+        """Получает процесс, которому принадлежит ключ."""
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class ShardManager:
+    """Решает, какой процесс обслуживает комнату.
+
+    Комната принадлежит процессу, который её закрепил, пока этот
+    процесс жив.
+    Так уже идущие игры не теряются при изменении состава процессов.
+    Незакреплённые комнаты и комнаты пропавших процессов принадлежат
+    процессу, выбранному кольцом консистентного хеширования.
+
+    Если распределение выключено, все комнаты принадлежат текущему
+    процессу и Redis не используется.
+
+    Закрепления комнат кешируются в памяти процесса, не больше
+    `CLAIMS_CACHE_SIZE` последних комнат.
+    Изменение закрепления рассылается всем процессам через шину
+    событий, и они забывают устаревшую запись.
+    Без шины закрепление каждый раз читается из Redis.
+
+    Комнату, закреплённую за другим живым процессом, закрепить нельзя.
+    Процесс помнит комнаты, которые обслуживает, и при каждой отметке
+    проверяет, что они всё ещё его.
+    Для каждой потерянной комнаты вызывается `on_lost`.
+
+    ID процесса занимается в Redis на время его работы.
+    Второй процесс с тем же ID не запустится, чтобы процессы не
+    перенаправляли запросы друг другу по кругу.
+
+    :param redis: Клиент Redis для хранения списка процессов.
+    :type redis: Redis
+    :param worker_id: Уникальный ID текущего процесса.
+    :type worker_id: str
+    :param url: Адрес, по которому доступен текущий процесс.
+    :type url: str
+    :param enabled: Включено ли распределение комнат.
+    :type enabled: bool
+    :param bus: Шина событий для сброса кеша закреплений.
+    :type bus: RedisEventBus | None
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        worker_id: str,
+        url: str,
+        enabled: bool = False,
+        bus: RedisEventBus | None = None,
+    ) -> None:
+        self._redis = redis
+        self.worker_id = worker_id
+        self.url = url
+        self.enabled = enabled
+        self._bus = bus
+        self._heartbeat = HEARTBEAT
+        self._ring = HashRing([worker_id])
+        self._urls: dict[str, str] = {worker_id: url}
+        self._claims: OrderedDict[str, str | None] = OrderedDict()
+        self._served: set[str] = set()
+        self._instance = uuid4().hex
+        self._task: asyncio.Task[None] | None = None
+        # Вызывается для каждой комнаты, перешедшей к другому процессу
+        self.on_lost: Callable[[str], Awaitable[None]] | None = None
+
+        if enabled and bus is not None:
+            bus.listen(CLAIMS_CHANNEL, self._forget_claim)
+
+    @staticmethod
+    def lock_key(worker_id: str) -> str:
+        """Получает ключ, которым процесс занимает свой ID."""
+        return f"shard:lock:{worker_id}"
+
+    async def start(self) -> None:
+        """Регистрирует процесс и начинает следить за остальными.
+
+        :raises RuntimeError: Если не указан адрес процесса или его ID
+            уже занят другим живым процессом.
+        """
+        if not self.enabled:
+            return
+        if not self.url:
+            raise RuntimeError("WORKER_URL is required for sharding")
+        locked = await self._redis.set(
+            self.lock_key(self.worker_id),
+            self._instance,
+            nx=True,
+            ex=int(self._heartbeat * 3) + 1,
+        )
+        if not locked:
+            raise RuntimeError(
+                f"Worker id {self.worker_id} is already used by another "
+                "process, set unique WORKER_ID and WORKER_URL"
+            )
+        await self.refresh()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Снимает процесс с учёта, чтобы его комнаты сразу переехали."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self._redis.zrem(WORKERS_KEY, self.worker_id)
+        if await self._redis.get(self.lock_key(self.worker_id)) == (
+            self._instance
+        ):
+            await self._redis.delete(self.lock_key(self.worker_id))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._heartbeat)
+            try:
+                await self.refresh()
+                await self._check_served()
+            except Exception as e:
+                logger.error("Failed to refresh shard workers: {}", e)
+
+    async def _check_served(self) -> None:
+        """Отдаёт комнаты, которые теперь обслуживают другие процессы."""
+        for room_id in list(self._served):
+            if await self.owner(room_id) == self.worker_id:
+                continue
+            logger.info("Room {} moved to another worker", room_id)
+            self._served.discard(room_id)
+            if self.on_lost is None:
+                continue
+            try:
+                await self.on_lost(room_id)
+            except Exception as e:
+                logger.error("Failed to hand off room {}: {}", room_id, e)
+
+    async def refresh(self) -> None:
+        """Обновляет отметку процесса и список живых процессов.
+
+        Процесс считается пропавшим, если не отмечался дольше трёх
+        периодов.
+        При изменении списка процессов кольцо пересобирается.
+        """
+        now = time.time()
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(
+                self.lock_key(self.worker_id),
+                self._instance,
+                ex=int(self._heartbeat * 3) + 1,
+            )
+            pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+            pipe.hset(URLS_KEY, self.worker_id, self.url)
+            pipe.zremrangebyscore(
+                WORKERS_KEY, "-inf", now - self._heartbeat * 3
+            )
+            pipe.zrange(WORKERS_KEY, 0, -1)
+            pipe.hgetall(URLS_KEY)
+            *_, workers, urls = await pipe.execute()
+
+        self._urls = urls
+        if set(workers) != self._ring.nodes:
+            logger.info("Rebalance rooms between workers: {}", workers)
+            self._ring.rebuild(workers)
+
+    async def owner(self, room_id: str) -> str:
+        """Получает ID процесса, который обслуживает комнату."""
+        if not self.enabled:
+            return self.worker_id
+
+        if room_id in self._claims:
+            self._claims.move_to_end(room_id)
+            claim = self._claims[room_id]
+        else:
+            claim = await self.claimed_by(room_id)
+            if self._bus is not None:
+                self._cache_claim(room_id, claim)
+        if claim is not None and claim in self._ring.nodes:
+            return claim
+        return self._ring.get(room_id) or self.worker_id
+
+    async def claimed_by(self, room_id: str) -> str | None:
+        """Получает процесс, за которым закреплена комната, из Redis."""
+        if not self.enabled:
+            return self.worker_id
+        return await self._redis.hget(CLAIMS_KEY, room_id)
+
+    def _cache_claim(self, room_id: str, claim: str | None) -> None:
+        self._claims[room_id] = claim
+        self._claims.move_to_end(room_id)
+        while len(self._claims) > CLAIMS_CACHE_SIZE:
+            self._claims.popitem(last=False)
+
+    def worker_url(self, worker_id: str) -> str | None:
+        """Получает адрес процесса."""
+        return self._urls.get(worker_id)
+
+    def new_room_id(self) -> UUID:
+        """Выбирает ID для новой комнаты, которая попадёт в этот процесс.
+
+        Подбирает случайный ID, пока кольцо не отдаст его текущему
+        процессу.
+        В среднем на это уходит столько попыток, сколько живых
+        процессов.
+        """
+        room_id = uuid4()
+        if not self.enabled or self.worker_id not in self._ring.nodes:
+            return room_id
+        while self._ring.get(str(room_id)) != self.worker_id:
+            room_id = uuid4()
+        return room_id
+
+    def _forget_claim(self, room_id: str) -> None:
+        """Забывает закрепление комнаты, изменённое другим процессом."""
+        self._claims.pop(room_id, None)
+
+    def _publish_claim(self, room_id: str) -> None:
+        self._claims.pop(room_id, None)
+        if self._bus is not None:
+            self._bus.notify(CLAIMS_CHANNEL, room_id)
+
+    async def claim(self, room_id: str) -> bool:
+        """Закрепляет комнату за текущим процессом.
+
+        Вызывается при создании игры и при восстановлении игры из
+        снимка.
+        Вернёт False, если комната уже закреплена за другим живым
+        процессом.
+        """
+        if not self.enabled:
+            return True
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(CLAIMS_KEY)
+                    current = await pipe.hget(CLAIMS_KEY, room_id)
+                    if (
+                        current is not None
+                        and current != self.worker_id
+                        and current in self._ring.nodes
+                    ):
+                        await pipe.reset()
+                        return False
+                    pipe.multi()
+                    pipe.hset(CLAIMS_KEY, room_id, self.worker_id)
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        self._served.add(room_id)
+        self._publish_claim(room_id)
+        return True
+
+    async def release(self, room_id: str) -> None:
+        """Открепляет комнату, когда в ней больше нет игры."""
+        self._served.discard(room_id)
+        if self.enabled:
+            await self._redis.hdel(CLAIMS_KEY, room_id)
+            self._publish_claim(room_id)
@@ -0,0 +1,308 @@
+"""Снимки игровых сессий.
+
+Игры комнат живут только в памяти процесса и пропадают при каждом
+перезапуске сервера.
+Чтобы игры переживали перезапуск, состояние каждой сессии
+периодически и при остановке сервера сохраняется в Redis.
+После запуска сессия восстанавливается при первом обращении к комнате.
+
+Снимок хранит только данные игры в JSON со своей версией формата:
+правила, колоду, руки игроков, очередь хода, счётчики револьвера и
+состояние блефа.
+Код из снимка никогда не выполняется, поэтому подменённый в Redis
+снимок может испортить разве что одну игру.
+Игра восстанавливается через обычное создание сессии и добавление
+игроков, после чего её состояние заменяется сохранённым.
+Движок не позволяет изменить правила созданной игры, поэтому если
+правила новой игры не совпадают с сохранёнными, игра не
+восстанавливается.
+"""
+
+import asyncio
+import time
+import zlib
+from collections.abc import Iterable
+from typing import Any
+
+from loguru import logger
+from mau.deck.card import MauCard
+from mau.game.game import MauGame
+from mau.game.player import BaseUser
+from mau.session import SessionManager
+from redis.asyncio.client import Redis
+
+from mau_server.schemes.game import (
+    SNAPSHOT_FORMAT,
+    GameSnapshot,
+    dump_snapshot,
+)
+
+# Версия формата снимка, хранится первым байтом
+SNAPSHOT_HEADER = bytes([SNAPSHOT_FORMAT])
+
+
+def _unpack(card: str) -> MauCard:
+    unpacked = MauCard.unpack(card)
+    if unpacked is None:
+        raise ValueError(f"Unknown card {card}")
+    return unpacked
+
+
+class SessionSnapshots:
+    """Сохраняет и восстанавливает игровые сессии.
+
+    Снимок комнаты обновляется, только если версия состояния игры
+    изменилась с момента прошлого сохранения.
+    Версию увеличивают не только события движка, но и маршруты,
+    изменяющие игру в обход событий, через `touch` обработчика
+    событий.
+    Если маршрут изменит игру, не увеличив версию, изменение попадёт
+    в снимок только вместе со следующим.
+
+    :param redis: Клиент Redis без декодирования ответов.
+    :type redis: Redis
+    :param sm: Менеджер игровых сессий.
+    :type sm: SessionManager
+    :param interval: Как часто сохранять изменившиеся игры. (в секундах)
+    :type interval: float
+    :param ttl: Сколько хранится снимок без обновлений. (в секундах)
+    :type ttl: int
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        sm: SessionManager[Any],
+        interval: float = 10.0,
+        ttl: int = 86_400,
+    ) -> None:
+        self._redis = redis
+        self._sm = sm
+        self._interval = interval
+        self._ttl = ttl
+        self._rooms: dict[str, int | None] = {}
+        self._checked: set[str] = set()
+        self._loading: dict[str, asyncio.Task[MauGame | None]] = {}
+        self._task: asyncio.Task[None] | None = None
+
+        self.saved = 0
+        self.saved_bytes = 0
+        self.restored = 0
+        self.restore_time = 0.0
+
+    @staticmethod
+    def key(room_id: str) -> str:
+        """Получает ключ снимка комнаты."""
+        return f"session:{room_id}"
+
+    def dump(self, game: MauGame) -> bytes:
+        """Запаковывает состояние игры в сжатый снимок."""
+        data = dump_snapshot(game).model_dump_json().encode()
+        return SNAPSHOT_HEADER + zlib.compress(data)
+
+    def load(self, data: bytes) -> GameSnapshot:
+        """Распаковывает состояние игры из снимка."""
+        if data[:1] != SNAPSHOT_HEADER:
+            raise ValueError("Unknown session snapshot format")
+        snapshot = GameSnapshot.model_validate_json(zlib.decompress(data[1:]))
+        if snapshot.format != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unknown snapshot format {snapshot.format}")
+        return snapshot
+
+    def build(self, snapshot: GameSnapshot) -> MauGame:
+        """Собирает игру из сохранённого состояния.
+
+        Игра создаётся через менеджер сессий, а игроки добавляются
+        в неё как обычно, поэтому менеджер сам узнаёт о них.
+        После этого колода, руки и очередь хода заменяются
+        сохранёнными.
+        """
+        players = {
+            pl.user_id: pl
+            for pl in (*snapshot.players, *snapshot.winners, *snapshot.losers)
+        }
+        game = self._sm.create(
+            snapshot.room_id, BaseUser(snapshot.owner_id, snapshot.owner_name)
+        )
+        for pl in players.values():
+            if pl.user_id != snapshot.owner_id:
+                game.join_player(BaseUser(pl.user_id, pl.name))
+        if snapshot.started:
+            game.start()
+        rules = [tuple(rule) for rule in game.rules.iter_rules()]
+        if rules != [tuple(rule) for rule in snapshot.rules]:
+            raise ValueError("Snapshot rules differ from game rules")
+
+        for pl in players.values():
+            player = self._sm.player(pl.user_id)
+            if player is None:
+                raise ValueError(f"Player {pl.user_id} was not restored")
+            player.hand = [_unpack(card) for card in pl.hand]
+            player.shotgun.cur = pl.shotgun_current
+            player.shotgun.lose = pl.shotgun_lose
+
+        game.pm._players = [pl.user_id for pl in snapshot.players]
+        game.pm.winners = [pl.user_id for pl in snapshot.winners]
+        game.pm.losers = [pl.user_id for pl in snapshot.losers]
+        game.pm._cp = snapshot.current_player
+        game.deck.cards = [_unpack(card) for card in snapshot.deck]
+        game.deck.used_cards = [_unpack(card) for card in snapshot.used]
+        game.deck._top = None if snapshot.top is None else _unpack(snapshot.top)
+        game.game_start = snapshot.game_started
+        game.turn_start = snapshot.turn_started
+        game.reverse = snapshot.reverse
+        game.take_counter = snapshot.take_counter
+        game.shotgun.cur = snapshot.shotgun_current
+        game.shotgun.lose = snapshot.shotgun_lose
+        game.state = snapshot.state
+        game.bluff_player = None
+        if snapshot.bluff_player is not None:
+            bluff_player = self._sm.player(snapshot.bluff_player[0])
+            if bluff_player is not None:
+                game.bluff_player = (bluff_player, snapshot.bluff_player[1])
+        return game
+
+    def track(self, room_id: str) -> None:
+        """Начинает сохранять игру комнаты."""
+        self._rooms[room_id] = None
+        self._checked.add(room_id)
+
+    def untrack(self, room_id: str) -> None:
+        """Перестаёт сохранять игру комнаты, не удаляя её снимок.
+
+        Если комната снова понадобится процессу, игра восстановится
+        из снимка.
+        """
+        self._rooms.pop(room_id, None)
+        self._checked.discard(room_id)
+
+    async def forget(self, room_id: str) -> None:
+        """Удаляет снимок завершённой игры."""
+        self._rooms.pop(room_id, None)
+        await self._redis.delete(self.key(room_id))
+
+    async def checkpoint(
+        self, force: bool = False, rooms: Iterable[str] | None = None
+    ) -> None:
+        """Сохраняет изменившиеся игры одним запросом.
+
+        :param force: Сохранить все игры, даже если они не изменились.
+        :type force: bool
+        :param rooms: Сохранить только игры этих комнат.
+        :type rooms: Iterable[str] | None
+        """
+        tracked = (
+            self._rooms.items()
+            if rooms is None
+            else [
+                (room_id, self._rooms[room_id])
+                for room_id in rooms
+                if room_id in self._rooms
+            ]
+        )
+        versions: dict[str, int] = {}
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for room_id, saved_version in tracked:
+                version = self._sm._event_handler.version(room_id)
+                if not force and version == saved_version:
+                    continue
+                game = self._sm.room(room_id)
+                if game is None:
+                    continue
+                try:
+                    data = self.dump(game)
+                except Exception as e:
+                    logger.error("Failed to dump session {}: {}", room_id, e)
+                    continue
+                pipe.set(self.key(room_id), data, ex=self._ttl)
+                versions[room_id] = version
+                self.saved += 1
+                self.saved_bytes += len(data)
+            if versions:
+                await pipe.execute()
+
+        for room_id, version in versions.items():
+            if room_id in self._rooms:
+                self._rooms[room_id] = version
+        if versions:
+            logger.debug("Saved {} sessions", len(versions))
+
+    async def restore(self, room_id: str) -> MauGame | None:
+        """Восстанавливает игру комнаты из снимка.
+
+        Redis опрашивается только при первом обращении к комнате после
+        запуска процесса.
+        Одновременные запросы к комнате дожидаются одной и той же
+        загрузки, а не считают, что игры нет.
+        """
+        if room_id in self._checked:
+            return None
+        task = self._loading.get(room_id)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(
+                self._restore(room_id)
+            )
+            self._loading[room_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(room_id, None))
+        return await asyncio.shield(task)
+
+    async def _restore(self, room_id: str) -> MauGame | None:
+        data = await self._redis.get(self.key(room_id))
+        # Комната отмечается проверенной только после загрузки, после
+        # неё и до конца сборки игры других ожиданий нет
+        self._checked.add(room_id)
+        if data is None:
+            return None
+
+        start = time.perf_counter()
+        try:
+            snapshot = self.load(data)
+            if snapshot.room_id != room_id:
+                raise ValueError(f"Snapshot of room {snapshot.room_id}")
+            game = self.build(snapshot)
+        except Exception as e:
+            logger.error("Failed to restore session {}: {}", room_id, e)
+            if self._sm.room(room_id) is not None:
+                self._sm.remove(room_id)
+            return None
+        # Клиенты видели только промежуточные события сборки игры,
+        # следующее событие отправит им полное состояние
+        self._sm._event_handler.forget(room_id)
+        self._sm._event_handler.touch(room_id)
+        self.restore_time += time.perf_counter() - start
+        self.restored += 1
+        self._rooms[room_id] = self._sm._event_handler.version(room_id)
+        logger.info("Restore session {} ({} bytes)", room_id, len(data))
+        return game
+
+    async def start(self) -> None:
+        """Запускает периодическое сохранение игр."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает сохранение и сохраняет все игры напоследок."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.checkpoint(force=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logger.error("Failed to save sessions: {}", e)
+
+    def stats(self) -> dict[str, float]:
+        """Статистика размера снимков и времени восстановления."""
+        return {
+            "rooms": len(self._rooms),
+            "saved": self.saved,
+            "avg_size": self.saved_bytes / self.saved if self.saved else 0,
+            "restored": self.restored,
+            "avg_restore_ms": self.restore_time / self.restored * 1000
+            if self.restored
+            else 0,
+        }
@@ -4,6 +4,9 @@
 Токены используются для подтверждения пользователя.
 """
 
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
 from datetime import datetime
 
 import jwt
@@ -25,11 +28,27 @@ class SimpleTokenManager:
     :type secret_key: str
     :param ttl: Сколько будет жить каждый токен. (в минутах)
     :type ttl: int
+    :param cache_size: Сколько проверенных токенов хранить в кеше.
+    :type cache_size: int
+    :param cache_ttl: Сколько хранить проверенный токен. (в секундах)
+    :type cache_ttl: float
     """
 
-    def __init__(self, secret_key: str, ttl: int) -> None:
+    def __init__(
+        self,
+        secret_key: str,
+        ttl: int,
+        cache_size: int = 4096,
+        cache_ttl: float = 60.0,
+    ) -> None:
         self._secret_key = secret_key
         self._ttl = ttl
+        self._cache_size = cache_size
+        self._cache_ttl = cache_ttl
+        self._cache: OrderedDict[str, tuple[float, User]] = OrderedDict()
+        self._user_tokens: dict[str, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
 
     def new_token(self, user: User) -> str:
         """Создаёт новый токен, привязанный к пользователю.
@@ -65,23 +84,103 @@ class SimpleTokenManager:
         базы данных.
         Иначе вернёт исключение.
 
+        Проверенные токены хранятся в кеше вместе с загруженным
+        пользователем, поэтому попадание в кеш не обращается к базе
+        данных.
+        Записи пользователя убираются из кеша через `invalidate` и
+        `forget` при изменении его данных в этом процессе.
+        Изменения из других процессов сервера станут видны не позже,
+        чем через время жизни записи.
+        Если пользователь сменил имя, старые токены перестают работать.
+        Кеш ограничен по размеру и времени жизни записей.
+
         :param cred: Данные пользователя для авторизации из заголовка.
         :type cred: HTTPAuthorizationCredentials
         :return: Пользователь, связанный с токеном.
         :rtype: User
         """
+        token = cred.credentials
+        now = time.monotonic()
+        cached = self._cache.get(token)
+        if cached is not None:
+            if cached[0] > now:
+                self._cache.move_to_end(token)
+                self.hits += 1
+                return cached[1]
+            self._drop(token)
+        self.misses += 1
+
         try:
-            payload = jwt.decode(
-                cred.credentials, self._secret_key, algorithms="HS256"
-            )
+            payload = jwt.decode(token, self._secret_key, algorithms="HS256")
         except Exception:
             raise HTTPException(401, "Invalid token")
 
-        if payload.get("expired") < int(datetime.now().timestamp()):
+        token_ttl = payload.get("expired") - int(datetime.now().timestamp())
+        if token_ttl < 0:
             raise HTTPException(401, "Token has expired")
 
         user = await User.get_or_none(username=payload.get("username"))
         if user is None:
             raise HTTPException(401, "Invalid user id")
 
+        self._put(token, now + min(self._cache_ttl, token_ttl), user)
         return user
+
+    def expires(self, token: str) -> int:
+        """Получает время окончания действия токена.
+
+        Токен должен быть уже проверен через `read_token`.
+
+        :param token: Проверенный токен.
+        :type token: str
+        :return: Когда токен перестанет действовать (UNIX время).
+        :rtype: int
+        """
+        payload = jwt.decode(token, self._secret_key, algorithms="HS256")
+        return payload["expired"]
+
+    def _put(self, token: str, expires: float, user: User) -> None:
+        self._cache[token] = (expires, user)
+        self._user_tokens.setdefault(user.username, set()).add(token)
+        while len(self._cache) > self._cache_size:
+            self._drop(next(iter(self._cache)))
+
+    def _drop(self, token: str) -> None:
+        username = self._cache.pop(token)[1].username
+        tokens = self._user_tokens.get(username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                self._user_tokens.pop(username)
+
+    def invalidate(self, user: User) -> None:
+        """Убирает из кеша все токены пользователя.
+
+        Вызывается при смене данных или пароля пользователя, чтобы
+        следующий запрос заново проверил токен и загрузил пользователя.
+
+        :param user: Пользователь, чьи данные изменились.
+        :type user: User
+        """
+        self.forget([user.username])
+
+    def forget(self, usernames: Iterable[str]) -> None:
+        """Убирает из кеша все токены пользователей по их именам.
+
+        Вызывается, когда данные пользователей изменились без
+        загрузки их моделей, например при записи итогов игр.
+
+        :param usernames: Имена пользователей.
+        :type usernames: Iterable[str]
+        """
+        for username in usernames:
+            for token in list(self._user_tokens.get(username, ())):
+                self._drop(token)
+
+    def stats(self) -> dict[str, int]:
+        """Получает статистику попаданий в кеш токенов."""
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,208 @@
+"""Ограничение времени хода.
+
+Если игрок надолго задумался или ушёл, игра останавливается, пока
+кто-нибудь не пропустит его ход вручную.
+Поэтому сервер сам пропускает ход, если он длится дольше отведённого
+времени.
+
+Сроки ходов всех комнат хранятся в одном колесе таймеров, а не в
+отдельной задаче на каждую комнату.
+Перенос срока при смене хода стоит O(1), а без игр колесо почти не
+тратит процессорное время.
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from loguru import logger
+from mau.game.game import MauGame
+from mau.session import SessionManager
+
+from mau_server.services.actors import RoomActors
+
+
+def skip_turn(game: MauGame) -> None:
+    """Пропускает ход текущего игрока.
+
+    Игрок берёт карты и ход переходит к следующему игроку.
+    """
+    game.take_counter += 1
+    game.player.take_cards()
+    game.next_turn()
+
+
+class TimerWheel:
+    """Колесо таймеров.
+
+    Время делится на такты, каждый такт попадает в одну из ячеек
+    колеса по кругу.
+    Срок хранится в ячейке своего такта, поэтому добавление и удаление
+    срока стоят O(1).
+    Сроки, до которых больше одного оборота колеса, просто ждут в
+    своей ячейке следующего оборота.
+
+    :param tick: Длительность одного такта. (в секундах)
+    :type tick: float
+    :param size: Количество ячеек колеса.
+    :type size: int
+    """
+
+    def __init__(self, tick: float = 1.0, size: int = 512) -> None:
+        self._tick = tick
+        self._size = size
+        self._slots: list[dict[str, float]] = [{} for _ in range(size)]
+        self._keys: dict[str, int] = {}
+        self._next = int(time.time() // tick)
+
+    def __len__(self) -> int:
+        """Количество установленных сроков."""
+        return len(self._keys)
+
+    def schedule(self, key: str, deadline: float) -> None:
+        """Устанавливает или переносит срок."""
+        self.cancel(key)
+        slot = max(int(deadline // self._tick), self._next) % self._size
+        self._slots[slot][key] = deadline
+        self._keys[key] = slot
+
+    def cancel(self, key: str) -> None:
+        """Убирает срок."""
+        slot = self._keys.pop(key, None)
+        if slot is not None:
+            self._slots[slot].pop(key, None)
+
+    def advance(self, now: float) -> list[str]:
+        """Прокручивает колесо до `now` и забирает истёкшие сроки."""
+        current = int(now // self._tick)
+        ticks = min(current - self._next + 1, self._size)
+        expired = []
+        for tick in range(self._next, self._next + ticks):
+            slot = self._slots[tick % self._size]
+            for key, deadline in list(slot.items()):
+                if deadline <= now:
+                    slot.pop(key)
+                    self._keys.pop(key)
+                    expired.append(key)
+        self._next = max(self._next, current)
+        return expired
+
+
+class TurnTimer:
+    """Пропускает ходы, которые длятся дольше отведённого времени.
+
+    Срок хода переносится при каждом изменении игры, от момента начала
+    текущего хода.
+    Истёкший ход пропускается через очередь команд комнаты, как если
+    бы его пропустили через маршрут.
+    Перед пропуском вызывается `serves`, если он задан: когда комната
+    уже завершена или обслуживается другим процессом, срок снимается.
+
+    :param sm: Менеджер игровых сессий.
+    :type sm: SessionManager
+    :param actors: Очереди команд комнат.
+    :type actors: RoomActors
+    :param timeout: Сколько длится ход, 0 отключает ограничение.
+        (в секундах)
+    :type timeout: float
+    :param tick: Точность срабатывания. (в секундах)
+    :type tick: float
+    """
+
+    def __init__(
+        self,
+        sm: SessionManager[Any],
+        actors: RoomActors,
+        timeout: float = 60.0,
+        tick: float = 1.0,
+    ) -> None:
+        self._sm = sm
+        self._actors = actors
+        self._timeout = timeout
+        self._tick = tick
+        self._wheel = TimerWheel(tick)
+        self._task: asyncio.Task[None] | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self.serves: Callable[[str], Awaitable[bool]] | None = None
+
+        self.skipped = 0
+
+    def deadline(self, game: MauGame) -> float:
+        """Получает время окончания текущего хода."""
+        return game.turn_start.timestamp() + self._timeout
+
+    def expired(self, game: MauGame) -> bool:
+        """Проверяет, вышло ли время текущего хода."""
+        return self._timeout > 0 and time.time() >= self.deadline(game)
+
+    def reschedule(self, room_id: str) -> None:
+        """Переносит срок хода после изменения игры."""
+        if self._timeout <= 0:
+            return
+        game = self._sm.room(room_id)
+        if game is None or not game.started:
+            self._wheel.cancel(room_id)
+            return
+        self._wheel.schedule(room_id, self.deadline(game))
+
+    def cancel(self, room_id: str) -> None:
+        """Убирает срок хода завершённой игры."""
+        self._wheel.cancel(room_id)
+
+    async def start(self) -> None:
+        """Начинает следить за сроками ходов."""
+        if self._timeout <= 0:
+            return
+        self._sm._event_handler.on_touch = self.reschedule
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Перестаёт следить за сроками ходов."""
+        if self._task is None:
+            return
+        self._sm._event_handler.on_touch = None
+        self._task.cancel()
+        await asyncio.gather(self._task, *self._tasks, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._tick)
+            for room_id in self._wheel.advance(time.time()):
+                task = loop.create_task(self._expire(room_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _expire(self, room_id: str) -> None:
+        try:
+            await self._actors.run(room_id, lambda: self._skip(room_id))
+        except Exception as e:
+            logger.error("Failed to skip turn in room {}: {}", room_id, e)
+
+    async def _skip(self, room_id: str) -> None:
+        # Пока команда ждала очереди, ход уже мог смениться
+        game = self._sm.room(room_id)
+        if game is None or not game.started:
+            return
+        if not self.expired(game):
+            self.reschedule(room_id)
+            return
+        if self.serves is not None and not await self.serves(room_id):
+            self.cancel(room_id)
+            return
+
+        logger.info("Turn timeout in room {}", room_id)
+        version = self._sm._event_handler.version(room_id)
+        skip_turn(game)
+        self.skipped += 1
+        self._sm._event_handler.changed(room_id, game, version)
+        # Не пропускаем ходы каждый такт, если движок не обновил
+        # время начала хода
+        if self.expired(game):
+            self._wheel.schedule(room_id, time.time() + self._timeout)
+
+    def stats(self) -> dict[str, float]:
+        """Получает количество ожидающих и пропущенных ходов."""
+        return {"rooms": len(self._wheel), "skipped": self.skipped}
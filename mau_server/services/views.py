@@ -0,0 +1,117 @@
+"""Закешированные представления игрового контекста.
+
+Каждый игровой маршрут отвечает полным контекстом игры, даже если
+с прошлого запроса игра не менялась.
+К тому же общая часть контекста одинакова для всех игроков комнаты.
+
+Поэтому закодированная игра хранится для каждой версии состояния
+комнаты, а закодированная рука игрока для каждой версии его комнаты.
+Версия увеличивается на каждое событие движка и на каждое изменение
+игры через маршруты, так что повторное чтение без изменений стоит
+одного поиска в словаре.
+
+Версии начинаются заново при каждом запуске процесса, поэтому ETag
+игры включает ещё и случайный номер запуска.
+"""
+
+from uuid import uuid4
+
+from mau.game.game import MauGame
+from mau.game.player import Player
+
+from mau_server.schemes.game import (
+    GameContext,
+    encode,
+    game_state,
+    player_state,
+)
+from mau_server.services.etag import make_etag
+from mau_server.services.events import WebSocketEventHandler
+
+
+class GameViews:
+    """Хранит закодированные представления последней версии игр.
+
+    Для каждой комнаты хранится только последняя версия игры, а для
+    каждого игрока только последняя версия его руки.
+
+    :param handler: Обработчик событий, который ведёт версии комнат.
+    :type handler: WebSocketEventHandler
+    """
+
+    def __init__(self, handler: WebSocketEventHandler) -> None:
+        self._handler = handler
+        self._games: dict[str, tuple[int, bytes]] = {}
+        self._players: dict[str, dict[str, tuple[int, bytes]]] = {}
+        self._epoch = uuid4().hex[:8]
+
+        self.hits = 0
+        self.misses = 0
+
+    def _game(self, game: MauGame, version: int) -> bytes:
+        cached = self._games.get(game.room_id)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        data = encode(game_state(game))
+        self._games[game.room_id] = (version, data)
+        return data
+
+    def _player(self, room_id: str, player: Player, version: int) -> bytes:
+        players = self._players.setdefault(room_id, {})
+        cached = players.get(player.user_id)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        data = encode(player_state(player, show_cards=True))
+        players[player.user_id] = (version, data)
+        return data
+
+    def context(self, ctx: GameContext, changed: bool = False) -> bytes:
+        """Получает закодированный контекст в формате `ContextData`.
+
+        :param ctx: Игровой контекст запроса.
+        :type ctx: GameContext
+        :param changed: Изменял ли запрос игру.
+        :type changed: bool
+        """
+        room_id = str(ctx.room.id)
+        if changed and ctx.game is not None:
+            ctx.version = self._handler.changed(room_id, ctx.game, ctx.version)
+        else:
+            ctx.version = self._handler.version(room_id)
+
+        game = b"null"
+        if ctx.game is not None:
+            game = self._game(ctx.game, ctx.version)
+        player = b"null"
+        if ctx.player is not None:
+            player = self._player(room_id, ctx.player, ctx.version)
+        return b'{"game":%b,"player":%b,"version":%d}' % (
+            game,
+            player,
+            ctx.version,
+        )
+
+    def etag(self, room_id: str, user_id: object) -> str:
+        """Получает ETag контекста пользователя для текущей версии игры."""
+        return make_etag(
+            self._epoch, room_id, self._handler.version(room_id), user_id
+        )
+
+    def forget(self, room_id: str) -> None:
+        """Забывает представления завершённой игры."""
+        self._games.pop(room_id, None)
+        self._players.pop(room_id, None)
+
+    def stats(self) -> dict[str, float]:
+        """Получает количество попаданий в кеш."""
+        return {
+            "rooms": len(self._games),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,154 @@
+"""Замер кодирования игрового контекста в JSON.
+
+Контекст кодируется на каждый ответ игровых маршрутов и на каждое
+событие, поэтому его стоимость напрямую влияет на задержку ходов.
+Новый способ собирает словари и сразу кодирует их в JSON.
+Для сравнения замеряется старый способ, когда состояние сначала
+собиралось в схемы pydantic с их проверкой, а затем кодировалось.
+
+Запуск: `python scripts/bench_encode.py`
+"""
+
+import asyncio
+import json
+import time
+from typing import Any
+
+from mau.deck.card import MauCard
+from mau.game.game import MauGame
+from mau.game.player import BaseUser, Player
+from mau.session import SessionManager
+
+from mau_server.schemes.game import (
+    CardData,
+    ContextData,
+    CoverCardsData,
+    GameData,
+    PlayerData,
+    encode,
+    game_state,
+    player_state,
+)
+from mau_server.schemes.roomlist import RoomMode
+from mau_server.services.events import WebSocketEventHandler
+
+PLAYERS = (2, 3, 4, 5, 6, 7)
+ROUNDS = 2000
+
+
+def old_player(player: Player, show_cards: bool = False) -> PlayerData:
+    """Старый способ: игрок собирается в схему."""
+    hand: int | CoverCardsData = len(player.hand)
+    if show_cards:
+        cards = player.cover_cards()
+        hand = CoverCardsData(
+            cover=[old_card(card) for card in cards.cover],
+            uncover=[old_card(card) for card in cards.uncover],
+        )
+    return PlayerData(
+        user_id=player.user_id,
+        name=player.name,
+        hand=hand,
+        shotgun_current=player.shotgun.cur,
+    )
+
+
+def old_card(card: MauCard) -> CardData:
+    """Старый способ: карта собирается в схему."""
+    return CardData(
+        color=card.color,
+        behavior=card.behavior.name,
+        value=card.value,
+        cost=card.cost,
+    )
+
+
+def old_context(game: MauGame, player: Player, version: int) -> bytes:
+    """Старый способ: контекст собирается в схемы и затем кодируется."""
+    bluff = game.bluff_player
+    data = GameData(
+        room_id=game.room_id,
+        rules=[
+            RoomMode(name=name, status=status)
+            for name, status in game.rules.iter_rules()
+        ],
+        owner_id=game.owner.user_id,
+        game_started=game.game_start,
+        turn_started=game.turn_start,
+        players=[old_player(pl) for pl in game.pm.iter(game.pm._players)],
+        winners=[old_player(pl) for pl in game.pm.iter(game.pm.winners)],
+        losers=[old_player(pl) for pl in game.pm.iter(game.pm.losers)],
+        current_player=game.pm._cp,
+        deck={
+            "top": old_card(game.deck._top) if game.deck._top else None,
+            "cards": len(game.deck.cards),
+            "used": len(game.deck.used_cards),
+        },
+        reverse=game.reverse,
+        take_counter=game.take_counter,
+        shotgun_current=game.shotgun.cur,
+        state=game.state,
+        bluff_player=None
+        if bluff is None
+        else (old_player(bluff[0]), bluff[1]),
+    )
+    return (
+        ContextData(
+            game=data,
+            player=old_player(player, show_cards=True),
+            version=version,
+        )
+        .model_dump_json()
+        .encode()
+    )
+
+
+def new_context(game: MauGame, player: Player, version: int) -> bytes:
+    """Новый способ: словари состояния сразу кодируются в JSON."""
+    return b'{"game":%b,"player":%b,"version":%d}' % (
+        encode(game_state(game)),
+        encode(player_state(player, show_cards=True)),
+        version,
+    )
+
+
+async def bench(players: int) -> tuple[int, float, float]:
+    """Замеряет размер контекста и время его кодирования.
+
+    Время возвращается в микросекундах.
+    """
+    sm: SessionManager[Any] = SessionManager(
+        event_handler=WebSocketEventHandler()
+    )
+    game = sm.create("bench", BaseUser("user0", "Player 0"))
+    for i in range(1, players):
+        game.join_player(BaseUser(f"user{i}", f"Player {i}"))
+    game.start()
+    player = game.player
+
+    data = new_context(game, player, 1)
+    if json.loads(data) != json.loads(old_context(game, player, 1)):
+        raise RuntimeError("Encoders disagree")
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        old_context(game, player, 1)
+    old = (time.perf_counter() - start) / ROUNDS * 1_000_000
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        new_context(game, player, 1)
+    new = (time.perf_counter() - start) / ROUNDS * 1_000_000
+    return len(data), old, new
+
+
+async def main() -> None:
+    """Печатает время кодирования контекста для разного числа игроков."""
+    print(f"{'players':>8} {'bytes':>7} {'pydantic, us':>13} {'new, us':>8}")
+    for players in PLAYERS:
+        size, old, new = await bench(players)
+        print(f"{players:>8} {size:>7} {old:>13.1f} {new:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
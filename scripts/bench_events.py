@@ -0,0 +1,96 @@
+"""Замер стоимости рассылки игрового события.
+
+Событие кодируется один раз на всю комнату, поэтому время отправки
+одного события почти не должно зависеть от количества наблюдателей.
+Для сравнения замеряется и старый способ, когда событие кодировалось
+заново для каждого подключения.
+
+Запуск: `python scripts/bench_events.py`
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from mau.enums import GameEvents
+from mau.game.game import MauGame
+from mau.game.player import BaseUser, Player
+from mau.session import SessionManager
+
+from mau_server.schemes.game import encode, game_state
+from mau_server.services.events import WebSocketEventHandler
+
+CLIENTS = (0, 1, 10, 100, 1000)
+EVENTS = 200
+PLAYERS = 6
+
+
+@dataclass(slots=True)
+class BenchEvent:
+    """Событие с теми полями, которые читает обработчик событий."""
+
+    game: MauGame
+    player: Player
+    event_type: GameEvents
+    data: str = ""
+
+
+class NullWebSocket:
+    """Сокет, который мгновенно принимает любые кадры."""
+
+    async def accept(self) -> None:
+        """Принимает подключение."""
+
+    async def send_text(self, frame: str) -> None:
+        """Отбрасывает кадр."""
+
+    async def close(self, code: int = 1000) -> None:
+        """Закрывает подключение."""
+
+
+def per_client(game: MauGame, clients: int) -> None:
+    """Старый способ: отдельное кодирование для каждого подключения."""
+    for _ in range(clients):
+        encode(game_state(game)).decode()
+
+
+async def bench(clients: int) -> tuple[float, float]:
+    """Замеряет время одного события в микросекундах."""
+    handler = WebSocketEventHandler(queue_size=EVENTS + 1)
+    sm: SessionManager[Any] = SessionManager(event_handler=handler)
+    game = sm.create("bench", BaseUser("user0", "Player 0"))
+    for i in range(1, PLAYERS):
+        game.join_player(BaseUser(f"user{i}", f"Player {i}"))
+    game.start()
+
+    for _ in range(clients):
+        await handler.connect("bench", NullWebSocket())  # type: ignore
+    event = BenchEvent(game, game.player, GameEvents.GAME_TURN)
+
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        handler.push(event)  # type: ignore
+    once = (time.perf_counter() - start) / EVENTS * 1_000_000
+
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        per_client(game, clients)
+    each = (time.perf_counter() - start) / EVENTS * 1_000_000
+
+    for connections in list(handler.clients.values()):
+        for connection in list(connections):
+            handler.disconnect(connection.room_id, connection.websocket)
+    return once, each
+
+
+async def main() -> None:
+    """Печатает время одного события для разного числа клиентов."""
+    print(f"{'clients':>8} {'once, us':>10} {'per client, us':>15}")
+    for clients in CLIENTS:
+        once, each = await bench(clients)
+        print(f"{clients:>8} {once:>10.1f} {each:>15.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""Замер задержки цикла событий во время массового входа.
+
+Пока идёт проверка паролей, каждую миллисекунду просыпается задача,
+которая изображает игровой маршрут, и замеряет, насколько позже
+положенного она проснулась.
+Если проверять пароли прямо в цикле событий, задержка вырастает до
+времени одной проверки bcrypt.
+С пулом потоков задержка должна остаться почти нулевой.
+
+Запуск: `python scripts/bench_passwords.py`
+"""
+
+import asyncio
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+
+import bcrypt
+
+from mau_server.services.passwords import PasswordHasher
+
+LOGINS = 32
+ROUNDS = 10
+TICK = 0.001
+
+
+async def game_route(stop: asyncio.Event, delays: list[float]) -> None:
+    """Просыпается каждую миллисекунду и записывает опоздание."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        delays.append(time.perf_counter() - start - TICK)
+
+
+async def storm(check: Callable[[], Awaitable[bool]]) -> list[float]:
+    """Выполняет `LOGINS` одновременных проверок пароля."""
+    stop = asyncio.Event()
+    delays: list[float] = []
+    route = asyncio.create_task(game_route(stop, delays))
+    await asyncio.gather(*(check() for _ in range(LOGINS)))
+    stop.set()
+    await route
+    return delays
+
+
+async def main() -> None:
+    """Печатает задержку маршрута без пула потоков и с ним."""
+    hasher = PasswordHasher(rounds=ROUNDS, max_pending=LOGINS)
+    password_hash = await hasher.hash("password")
+
+    async def inline() -> bool:
+        return bcrypt.checkpw(b"password", password_hash.encode())
+
+    async def pooled() -> bool:
+        return await hasher.verify("password", password_hash)
+
+    print(f"{'mode':>8} {'p50, ms':>8} {'p99, ms':>8} {'max, ms':>8}")
+    for name, check in (("inline", inline), ("pool", pooled)):
+        delays = sorted(await storm(check)) or [0.0]
+        p50 = statistics.median(delays)
+        p99 = delays[int(len(delays) * 0.99)]
+        print(
+            f"{name:>8} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f}"
+            f" {delays[-1] * 1000:>8.2f}"
+        )
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
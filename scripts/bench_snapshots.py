@@ -0,0 +1,62 @@
+"""Замер размера снимка игры и времени его восстановления.
+
+Снимок хранится в Redis для каждой идущей игры и перезаписывается
+после её изменений, поэтому важны и его размер, и время сборки.
+Восстановление замеряется целиком: распаковка, проверка схемы и
+сборка игры через менеджер сессий.
+
+Запуск: `python scripts/bench_snapshots.py`
+"""
+
+import asyncio
+import time
+from typing import Any
+
+from mau.game.player import BaseUser
+from mau.session import SessionManager
+
+from mau_server.services.events import WebSocketEventHandler
+from mau_server.services.snapshots import SessionSnapshots
+
+PLAYERS = (2, 3, 4, 5, 6, 7)
+ROUNDS = 500
+
+
+async def bench(players: int) -> tuple[int, float, float]:
+    """Замеряет размер снимка и время сохранения и восстановления.
+
+    Время возвращается в микросекундах.
+    """
+    sm: SessionManager[Any] = SessionManager(
+        event_handler=WebSocketEventHandler()
+    )
+    snapshots = SessionSnapshots(None, sm)  # type: ignore
+    game = sm.create("bench", BaseUser("user0", "Player 0"))
+    for i in range(1, players):
+        game.join_player(BaseUser(f"user{i}", f"Player {i}"))
+    game.start()
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        data = snapshots.dump(game)
+    dump = (time.perf_counter() - start) / ROUNDS * 1_000_000
+
+    restore = 0.0
+    for _ in range(ROUNDS):
+        sm.remove("bench")
+        start = time.perf_counter()
+        snapshots.build(snapshots.load(data))
+        restore += time.perf_counter() - start
+    return len(data), dump, restore / ROUNDS * 1_000_000
+
+
+async def main() -> None:
+    """Печатает размер снимка и время работы с ним."""
+    print(f"{'players':>8} {'bytes':>7} {'dump, us':>9} {'restore, us':>12}")
+    for players in PLAYERS:
+        size, dump, restore = await bench(players)
+        print(f"{players:>8} {size:>7} {dump:>9.1f} {restore:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""Количество SQL запросов для схем ответов.
+
+Каждая связь схемы загружается отдельным запросом.
+Тесты следят, чтобы количество запросов не зависело от количества
+записей и не росло от случайно добавленных в схему связей.
+"""
+
+import unittest
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from tortoise import Tortoise, connections
+
+from mau_server.models import Room, User
+from mau_server.schemes.db import RoomData, RoomListData, UserData
+
+# Методы подключения, через которые выполняются все запросы
+EXECUTE_METHODS = (
+    "execute_insert",
+    "execute_many",
+    "execute_query",
+    "execute_query_dict",
+    "execute_script",
+)
+
+
+class QueryCounter:
+    """Считает запросы, выполненные через подключение к базе данных."""
+
+    def __init__(self, connection: Any) -> None:  # noqa: ANN401
+        self.count = 0
+        self._connection = connection
+        self._methods: dict[str, Callable[..., Awaitable[Any]]] = {}
+
+    def _wrap(
+        self, method: Callable[..., Awaitable[Any]]
+    ) -> Callable[..., Awaitable[Any]]:
+        async def execute(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            self.count += 1
+            return await method(*args, **kwargs)
+
+        return execute
+
+    def __enter__(self) -> "QueryCounter":
+        """Начинает считать запросы."""
+        for name in EXECUTE_METHODS:
+            method = getattr(self._connection, name)
+            self._methods[name] = method
+            setattr(self._connection, name, self._wrap(method))
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """Возвращает подключению исходные методы."""
+        for name, method in self._methods.items():
+            setattr(self._connection, name, method)
+
+
+class TestSchemeQueries(unittest.IsolatedAsyncioTestCase):
+    """Количество запросов при выдаче пользователей и комнат."""
+
+    async def asyncSetUp(self) -> None:
+        """Создаёт 5 пользователей и 5 комнат со всеми игроками."""
+        await Tortoise.init(
+            config={
+                "connections": {"models": "sqlite://:memory:"},
+                "apps": {
+                    "models": {
+                        "models": ["mau_server.models"],
+                        "default_connection": "models",
+                    }
+                },
+            }
+        )
+        await Tortoise.generate_schemas()
+        self.users = [
+            await User.create(
+                username=f"user{i}", name=f"User {i}", password_hash=""
+            )
+            for i in range(5)
+        ]
+        for i, owner in enumerate(self.users):
+            room = await Room.create(name=f"Room {i}", owner=owner)
+            await room.players.add(*self.users)
+
+    async def asyncTearDown(self) -> None:
+        """Закрывает базу данных в памяти."""
+        await Tortoise.close_connections()
+
+    def count(self) -> QueryCounter:
+        """Считает запросы к базе данных моделей."""
+        return QueryCounter(connections.get("models"))
+
+    async def test_user_list(self) -> None:
+        """Список пользователей загружается одним запросом."""
+        with self.count() as counter:
+            await UserData.from_queryset(User.all())
+        self.assertEqual(counter.count, 1)
+
+    async def test_user_detail(self) -> None:
+        """Профиль пользователя загружается одним запросом."""
+        with self.count() as counter:
+            await UserData.from_queryset_single(User.get(username="user0"))
+        self.assertEqual(counter.count, 1)
+
+    async def test_room_list(self) -> None:
+        """Комнаты и их владельцы, независимо от количества комнат."""
+        with self.count() as counter:
+            rooms = await RoomListData.from_queryset(Room.all())
+        self.assertEqual(len(rooms), 5)
+        self.assertEqual(counter.count, 2)
+
+    async def test_room_detail(self) -> None:
+        """Комната, её владелец, связи игроков и сами игроки."""
+        room = await Room.first()
+        with self.count() as counter:
+            data = await RoomData.from_queryset_single(Room.get(id=room.id))
+        self.assertEqual(len(data.players), 5)
+        self.assertEqual(counter.count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()